@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of join detection in on_info against a server log
+
+A synthetic log is generated unless a real one is given.
+Usage: python benchmarks/bench_matcher.py [path/to/latest.log] [rounds]
+"""
+import os
+import re
+import sys
+import random
+import timeit
+import importlib.util
+
+from typing import List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# [12:00:00] [Server thread/INFO]: <content>, MCDR passes <content> to on_info as info.content
+LOG_LINE = re.compile(r'^\[[\d:]+] \[[^]]+/\w+]: (.*)$')
+
+
+def load_matcher_module():
+    # Importing the mcd_seen package needs a running MCDR, the matcher module itself doesn't
+    spec = importlib.util.spec_from_file_location('seen_matcher', os.path.join(HERE, '..', 'mcd_seen', 'matcher.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_contents(lines: int = 3000, seed: int = 0) -> List[str]:
+    """
+    Synthetic on_info contents, about one line in ten is a join or leave and the rest is the usual noise
+    """
+    rnd = random.Random(seed)
+    players = [f'Player{i:03d}' for i in range(30)]
+    bots = ['bot_farm', 'bot_trader', 'Steve_cam']
+    noise = [
+        lambda: f"Can't keep up! Is the server overloaded? Running {rnd.randrange(2000, 9000)}ms or "
+                f"{rnd.randrange(40, 180)} ticks behind",
+        lambda: 'Saved the game',
+        lambda: f'<{rnd.choice(players)}> {rnd.choice(["hi", "!!seen-top", "anyone at spawn?", "brb"])}',
+        lambda: f"Villager class_1646['Villager'/{rnd.randrange(100, 999)}, l='ServerLevel[world]', "
+                f"x={rnd.uniform(-200, 200):.1f}, y=64.0, z={rnd.uniform(-200, 200):.1f}] died, "
+                f"message: 'Villager was slain by Zombie'",
+        lambda: f'{rnd.choice(players)} has made the advancement [Stone Age]',
+    ]
+    ret = []
+    for _ in range(lines):
+        roll = rnd.random()
+        if roll < 0.03:
+            name = rnd.choice(players)
+            ret.append(f'{name}[/10.0.0.{rnd.randrange(2, 250)}:{rnd.randrange(40000, 60000)}] logged in with '
+                       f'entity id {rnd.randrange(100, 99999)} at ({rnd.uniform(-500, 500):.1f}, 64.0, '
+                       f'{rnd.uniform(-500, 500):.1f})')
+        elif roll < 0.04:
+            ret.append(f'{rnd.choice(bots)}[local] logged in with entity id {rnd.randrange(100, 99999)} at '
+                       f'([world]{rnd.uniform(-500, 500):.1f}, 64.0, {rnd.uniform(-500, 500):.1f})')
+        elif roll < 0.1:
+            ret.append(f'{rnd.choice(players + bots)} left the game')
+        else:
+            ret.append(rnd.choice(noise)())
+    return ret
+
+
+def read_contents(path: str):
+    ret = []
+    with open(path, 'r', encoding='UTF-8', errors='replace') as f:
+        for line in f:
+            result = LOG_LINE.match(line.rstrip('\n'))
+            if result is not None:
+                ret.append(result.group(1))
+    return ret
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    contents = read_contents(path) if path is not None else generate_contents()
+    matcher_module = load_matcher_module()
+    matcher = matcher_module.LineMatcher(matcher_module.DEFAULT_PATTERNS)
+
+    def run_matcher():
+        return [e for e in map(matcher.match, contents) if e is not None]
+
+    cases = [('LineMatcher', run_matcher)]
+    try:
+        from parse import parse
+
+        def run_parse():
+            # What on_info did before, join lines only
+            ret = []
+            for content in contents:
+                psd = parse('{name}[{ip}] logged in with entity id {id} at {loc}', content)
+                if psd is not None:
+                    ret.append(psd)
+            return ret
+        cases.append(('parse (join only)', run_parse))
+    except ImportError:
+        pass
+
+    print(f'{len(contents)} lines from {path or "a synthetic log"}, {len(run_matcher())} events matched')
+    for name, func in cases:
+        cost = min(timeit.repeat(func, number=1, repeat=rounds))
+        print(f'{name:<20} {cost * 1000:8.2f} ms total {cost / len(contents) * 1e6:8.2f} us/line')
+
+
+if __name__ == '__main__':
+    main()
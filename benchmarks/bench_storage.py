@@ -0,0 +1,167 @@
+"""
+Benchmark of SeenStorage and the rank commands on synthetic histories, with timings and peak memory
+
+Every size runs in its own process against a scratch directory, see mcdr_stub.py for the MCDR stand-in.
+
+Usage: python benchmarks/bench_storage.py [--sizes 1000,100000,1000000] [--rounds 5]
+                                          [--config '{"compact_records": true, "snapshot_format": "binary"}']
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+
+from statistics import median
+from typing import Any, Callable, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEEN_TOP_ARGS = [
+    None, '-bot', '-all', '-merge',
+    '-full', '-bot -full', '-all -full', '-merge -full',
+    '-full -page 2', '-all -page 3 -size 20'
+]
+LIVER_TOP_ARGS = [None, '-bot', '-all', '-merge']
+
+
+def generate_history(size: int, seed: int = 0) -> dict:
+    """
+    Players with a bot share of about 20%, a third of the bots named after a player, and 1% of everyone online
+    """
+    rnd = random.Random(seed)
+    now = int(time.time())
+    ret = {}
+    for i in range(size):
+        name = f'Player{i:07d}'
+        roll = rnd.random()
+        if roll < 0.2:
+            # Bots are usually named after their owner
+            name = (name if roll < 0.07 else f'bot_{i:07d}') + '@bot'
+        joined = now - rnd.randrange(1, 3 * 365 * 86400)
+        left = joined + rnd.randrange(60, 6 * 3600)
+        if rnd.random() < 0.01:
+            joined, left = left + 1, joined
+        ret[name] = {'joined': joined, 'left': left}
+    return ret
+
+
+def measure(func: Callable[[], Any], rounds: int) -> Tuple[float, float]:
+    """
+    :return: Median seconds of rounds runs, and the peak traced memory in bytes of an extra traced run
+    """
+    costs = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        costs.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return median(costs), peak
+
+
+def report(name: str, cost: float, peak: int, ops: int = 1):
+    per_op = f'{cost / ops * 1e6:10.2f} us/op' if ops > 1 else ''
+    print(f'  {name:<34} {cost * 1000:10.2f} ms {per_op:>16} {peak / 1024 / 1024:10.2f} MiB peak')
+
+
+def run(size: int, rounds: int, config: dict):
+    sys.path.insert(0, HERE)
+    import mcdr_stub
+
+    workdir = tempfile.mkdtemp(prefix='seen-bench-')
+    mcdr_stub.install(workdir, config=dict(config, log_seens=False))
+    history = generate_history(size)
+    with open(os.path.join('config', 'seen', 'seen.json'), 'w', encoding='UTF-8') as f:
+        json.dump(history, f)
+    names = list(history.keys())
+    del history
+
+    start = time.perf_counter()
+    import mcd_seen     # noqa, imports every module
+    storage_module = sys.modules['mcd_seen.storage']
+    interface = sys.modules['mcd_seen.interface']
+    storage = storage_module.storage.load()
+    import_cost = time.perf_counter() - start
+
+    print(f'{size} players, config {json.dumps(config)}, in {workdir}')
+    print(f'  {"import and first load":<34} {import_cost * 1000:10.2f} ms')
+    # Save first so load reads the snapshot in the configured format instead of the generated seen.json
+    report('SeenStorage.save', *measure(storage.save, rounds))
+    report('SeenStorage.load', *measure(lambda: storage_module.SeenStorage().load(), rounds))
+    report('handoff on reload', *measure(lambda: storage_module.SeenStorage().adopt(storage.handoff()), rounds))
+
+    rnd = random.Random(1)
+    lookups = [rnd.choice(names) for _ in range(10000)]
+    lookups = [n[:-4] if n.endswith('@bot') else n for n in lookups]
+    lookups = [n.upper() if i % 2 else n for i, n in enumerate(lookups)]
+
+    def get_all():
+        for n in lookups:
+            storage.get(n)
+    report('SeenStorage.get', *measure(get_all, rounds), ops=len(lookups))
+
+    for liver, cases in ((False, SEEN_TOP_ARGS), (True, LIVER_TOP_ARGS)):
+        for exarg in cases:
+            args = interface.ExtraArguments.parse(exarg, liver)
+            if args.full:
+                offset, limit = (args.page - 1) * args.size, args.size
+            else:
+                offset, limit = 0, storage_module.config.seen_top_max
+
+            def query():
+                if args.merge:
+                    return storage.merged_top(liver, limit=limit, offset=offset)
+                get_top = storage.liver_top if liver else storage.seen_top
+                return get_top(bot=args.bot, _all=args.get_all, limit=limit, offset=offset)
+            command = 'liver_top' if liver else 'seen_top'
+            report(f'{command} {exarg or ""}', *measure(query, rounds))
+
+            def reply():
+                source = mcdr_stub.StubCommandSource()
+                interface.seen_top(source, exarg, liver)
+                return mcdr_stub.render(source.replies[-1])
+            report('  + reply rendering', *measure(reply, rounds))
+
+    def seen_reply():
+        source = mcdr_stub.StubCommandSource()
+        for n in lookups[:1000]:
+            interface.seen(source, n)
+        return [mcdr_stub.render(r) for r in source.replies]
+    report('!!seen <player> rendering', *measure(seen_reply, rounds), ops=1000)
+
+    storage.close()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'  {"max RSS of the process":<34} {max_rss / 1024:10.2f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000', help='Comma separated player counts, e.g. 1000,100000,1000000')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--config', default='{}', help='Config overrides in JSON')
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    config = json.loads(args.config)
+    if args.run is not None:
+        run(args.run, args.rounds, config)
+        return
+    for size in map(int, args.sizes.split(',')):
+        # A fresh process for each size keeps the peak memory figures apart
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', str(size), '--rounds', str(args.rounds),
+             '--config', args.config],
+            check=True
+        )
+
+
+if __name__ == '__main__':
+    main()
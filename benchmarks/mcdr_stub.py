@@ -0,0 +1,136 @@
+"""
+Stand-in for the MCDR server interface, so the mcd_seen package can be imported and driven outside a running MCDR
+
+mcd_seen reads ServerInterface.get_instance() at import time and keeps its data under config/seen of the working
+directory, install() patches the former and moves into a scratch directory for the latter.
+MCDReforged itself still needs to be installed, only the running server is replaced
+"""
+import os
+import sys
+import json
+
+from typing import Any, Dict, List, Optional
+
+from mcdreforged.api.rtext import RTextBase, RTextMCDRTranslation
+from mcdreforged.api.types import ServerInterface
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+class StubMetadata:
+    def __init__(self):
+        with open(os.path.join(ROOT, 'mcdreforged.plugin.json'), 'r', encoding='UTF-8') as f:
+            meta = json.load(f)
+        self.id = meta['id']
+        self.name = meta['name']
+        self.version = meta['version']
+
+
+class StubServerInterface:
+    """
+    The part of PluginServerInterface used by mcd_seen, translations are read from the lang folder
+    """
+    def __init__(self, language: str = 'en_us', running: bool = False):
+        self.language = language
+        self.running = running
+        self.metadata = StubMetadata()
+        self.commands = []      # type: List[Any]
+        self.__translations = {}    # type: Dict[str, Dict[str, str]]
+
+    def as_plugin_server_interface(self):
+        return self
+
+    def get_self_metadata(self):
+        return self.metadata
+
+    def get_mcdr_language(self) -> str:
+        return self.language
+
+    def is_server_running(self) -> bool:
+        return self.running
+
+    def load_config_simple(self, file_name: str, default_config: dict, target_class=None, **kwargs):
+        data = dict(default_config)
+        if os.path.isfile(file_name):
+            with open(file_name, 'r', encoding='UTF-8') as f:
+                data.update(json.load(f))
+        return target_class.deserialize(data) if target_class is not None else data
+
+    def __load_language(self, language: str) -> Dict[str, str]:
+        if language not in self.__translations:
+            from ruamel.yaml import YAML
+            path = os.path.join(ROOT, 'lang', f'{language}.yml')
+            translations = {}
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='UTF-8') as f:
+                    translations = dict(YAML(typ='safe').load(f))
+            self.__translations[language] = translations
+        return self.__translations[language]
+
+    def tr(self, translation_key: str, *args, _mcdr_tr_language: Optional[str] = None, language: Optional[str] = None,
+           allow_failure: bool = True, **kwargs):
+        translations = self.__load_language(_mcdr_tr_language or language or self.language)
+        if translation_key not in translations:
+            if allow_failure:
+                return translation_key
+            raise KeyError(translation_key)
+        return translations[translation_key].format(*args, **kwargs)
+
+    def rtr(self, translation_key: str, *args, **kwargs) -> RTextMCDRTranslation:
+        return RTextMCDRTranslation(translation_key, *args, **kwargs)
+
+    def register_command(self, node):
+        self.commands.append(node)
+
+    def register_help_message(self, *args, **kwargs):
+        pass
+
+    def reload_plugin(self, plugin_id: str):
+        pass
+
+
+class StubCommandSource:
+    """
+    Keeps the replies instead of sending them
+    """
+    def __init__(self, permission: int = 4):
+        self.permission = permission
+        self.replies = []       # type: List[Any]
+
+    def reply(self, message: Any, **kwargs):
+        self.replies.append(message)
+
+    def has_permission(self, level: int) -> bool:
+        return self.permission >= level
+
+    def get_server(self):
+        return ServerInterface.get_instance()
+
+
+def render(message: Any) -> str:
+    """
+    Resolve translations and flatten the message like a console reply would
+    """
+    if isinstance(message, RTextBase):
+        return message.to_plain_text()
+    return str(message)
+
+
+def install(workdir: str, config: Optional[dict] = None, **kwargs) -> StubServerInterface:
+    """
+    Patch ServerInterface.get_instance and move into workdir, call this before importing mcd_seen
+    :param workdir: Scratch directory, config/seen is created in it
+    :param config: Written to config/seen/config.json, overriding the defaults
+    :param kwargs: Passed to StubServerInterface
+    """
+    interface = StubServerInterface(**kwargs)
+    ServerInterface.get_instance = classmethod(lambda cls: interface)
+    os.makedirs(os.path.join(workdir, 'config', 'seen'), exist_ok=True)
+    os.chdir(workdir)
+    if config is not None:
+        with open(os.path.join('config', 'seen', 'config.json'), 'w', encoding='UTF-8') as f:
+            json.dump(config, f)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return interface
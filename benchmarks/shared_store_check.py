@@ -0,0 +1,166 @@
+"""
+Check of the 'shared' storage mode with several servers writing to one SQLite database, each in its own process
+
+Every server is a worker process driven over its stdin by the controller, see mcdr_stub.py for the MCDR stand-in.
+The scenarios:
+  stress   every server records joins and leaves concurrently, then all of them must agree on the records
+  move     a player moves to another server before leaving this one, this one must show the player online there
+
+Usage: python benchmarks/shared_store_check.py [--servers 4] [--events 300]
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Prefixes the replies of a worker, the logger of mcd_seen writes to stdout as well
+REPLY = 'REPLY '
+
+
+def serve(server: str, database: str):
+    """
+    Worker loop, reads a JSON command per line and replies once the storage has applied it
+    """
+    sys.path.insert(0, HERE)
+    import mcdr_stub
+
+    mcdr_stub.install(
+        os.path.join(os.path.dirname(database), server),
+        config={'storage_mode': 'shared', 'shared_database': database, 'server_name': server, 'log_seens': False}
+    )
+    import mcd_seen     # noqa, imports every module
+    storage = sys.modules['mcd_seen.storage'].storage.load()
+
+    def status(name: str) -> Any:
+        seen = storage.get(name)
+        return None if seen is None else [seen.name, seen.online, seen.joined, seen.left]
+
+    for line in sys.stdin:
+        command, *args = json.loads(line)
+        result = None   # type: Any
+        if command == 'join':
+            storage.player_joined(*args)
+        elif command == 'leave':
+            storage.player_left(*args)
+        elif command == 'churn':
+            for i in range(args[0]):
+                name = f'{server}_p{i % 50}'
+                storage.player_joined(name)
+                storage.player_left(name)
+                storage.player_joined('Shared')
+                storage.player_left('Shared')
+        elif command == 'sync':
+            storage.sync()
+        elif command == 'status':
+            storage.wait_until_drained()
+            result = status(args[0])
+        elif command == 'rows':
+            result = sorted(storage.rows())
+        storage.wait_until_drained()
+        print(REPLY + json.dumps(result), flush=True)
+        if command == 'quit':
+            break
+    storage.close()
+
+
+class Worker:
+    def __init__(self, server: str, database: str):
+        self.server = server
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', server, database],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+
+    def send(self, *command) -> None:
+        self.process.stdin.write(json.dumps(command) + '\n')
+        self.process.stdin.flush()
+
+    def receive(self) -> Any:
+        for line in self.process.stdout:
+            if line.startswith(REPLY):
+                return json.loads(line[len(REPLY):])
+        raise RuntimeError(f'Server {self.server} exited with {self.process.wait()}')
+
+    def call(self, *command) -> Any:
+        self.send(*command)
+        return self.receive()
+
+    def quit(self):
+        self.call('quit')
+        self.process.wait()
+
+
+def check(name: str, passed: bool, detail: Any = ''):
+    print(f'  {"ok  " if passed else "FAIL"} {name} {detail}')
+    if not passed:
+        check.failed = True
+
+
+check.failed = False
+
+
+def stress(database: str, servers: int, events: int):
+    print(f'stress: {servers} servers, {events} rounds of joins and leaves each')
+    workers = [Worker(f's{i}', database) for i in range(servers)]
+    # Sent to all the servers before waiting for any, so they write at the same time
+    for w in workers:
+        w.send('churn', events)
+    for w in workers:
+        w.receive()
+    for w in workers:
+        w.call('sync')
+    rows = [w.call('rows') for w in workers]   # type: List[List[Any]]
+    for w in workers:
+        w.quit()
+    conn = sqlite3.connect(database)
+    count, versions = conn.execute('SELECT COUNT(*), COUNT(DISTINCT version) FROM seen_shared').fetchone()
+    conn.close()
+    check('every write took its own version', count == versions, f'({count} rows, {versions} versions)')
+    check('every server ends up with the same records', all(r == rows[0] for r in rows))
+    check('nobody is left online', all(not j > l for r in rows for _, j, l in r))
+
+
+def move(database: str):
+    print('move: a player joins server b while still online on server a, then leaves a')
+    a, b = Worker('a', database), Worker('b', database)
+    a.call('join', 'Mover')
+    b.call('sync')
+    b.call('join', 'Mover')
+    # Online on both, a keeps its own record but remembers the one of b
+    a.call('sync')
+    check('online on a before leaving it', a.call('status', 'Mover')[1])
+    a.call('leave', 'Mover')
+    statuses = {w.server: w.call('status', 'Mover') for w in (a, b)}    # type: Dict[str, Any]
+    check('a shows the player online on b after leaving a', statuses['a'][1], statuses['a'])
+    check('b shows the player online', statuses['b'][1], statuses['b'])
+    b.call('leave', 'Mover')
+    a.call('sync')
+    check('a shows the player offline after leaving b', not a.call('status', 'Mover')[1])
+    for w in (a, b):
+        w.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', type=int, default=4)
+    parser.add_argument('--events', type=int, default=300)
+    parser.add_argument('--serve', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve is not None:
+        serve(*args.serve)
+        return
+    workdir = tempfile.mkdtemp(prefix='seen-shared-')
+    print(f'in {workdir}')
+    stress(os.path.join(workdir, 'stress.db'), args.servers, args.events)
+    move(os.path.join(workdir, 'move.db'))
+    sys.exit(1 if check.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,41 @@
-from parse import parse
+import threading
+
 from mcdreforged.api.types import Info, PluginServerInterface
 from mcdreforged.api.decorator import new_thread
 
-from mcd_seen.utils import verify_player_name, bot_name, tr, logger, psi
-from mcd_seen.storage import storage, bot_list
+from mcd_seen.utils import bot_name, tr, logger, psi
+from mcd_seen.storage import storage, bot_list, shadow_list
 from mcd_seen.config import config
+from mcd_seen.constants import STATS_FILE
 from mcd_seen.interface import register_command
+from mcd_seen.matcher import LineMatcher, JOIN, LIST_PATTERNS, split_player_list
+from mcd_seen.stats import stats
+# API for other plugins, reached with get_plugin_instance('mcd_seen')
+from mcd_seen.api import API_VERSION, SeenRecord, is_ready, get_player, get_players, seen_top, liver_top, count, \
+    active_since, inactive_since, iter_online, iter_offline
+
+line_matcher = LineMatcher(config.line_patterns)
+match_line = stats.timed('on_info.match')(line_matcher.match)
+list_matcher = LineMatcher(LIST_PATTERNS)
+# Set while waiting for the reply of the list command sent by reconcile_online_players
+list_requested = threading.Event()
 
 
 def on_info(server: PluginServerInterface, info: Info) -> None:
+    if info.is_from_server and list_requested.is_set():
+        event = list_matcher.match(info.content)
+        if event is not None:
+            list_requested.clear()
+            storage.reconcile(split_player_list(event.name))
+            return
     if info.is_from_server and config.identify_bot:
+        # Leaves of players and bots alike come from on_player_left, bots are told apart by bot_list
+        event = match_line(info.content)
+        if event is None or event.event != JOIN:
+            return
+        stats.count(f'on_info.{event.event}')
         logger.debug('Join event found with on_info')
-        psd = parse('{name}[{ip}] logged in with entity id {id} at {loc}', info.content)
-        if psd is not None and verify_player_name(psd['name']):
-            player_name = bot_name(psd['name']) if psd['ip'] == 'local' else psd['name']
-            storage.player_joined(player_name)
+        storage.player_joined(bot_name(event.name) if event.bot else event.name)
 
 
 def on_player_joined(server: PluginServerInterface, player: str, info: Info = None):
@@ -24,36 +45,67 @@ def on_player_joined(server: PluginServerInterface, player: str, info: Info = No
 
 
 def on_player_left(server: PluginServerInterface, player: str):
-    server.get_instance()       # to satisfy pycharm >3
+    logger.debug('Leave event found with on_player_left')
     storage.player_left(player)
 
 
+def on_server_startup(*args, **kwargs):
+    # Nobody is online yet, players left online by a crash are set offline, their sessions ended at an unknown time
+    # and aren't counted into playtime
+    storage.reconcile([])
+
+
 def on_server_stop(*args, **kwargs):
     list(args).clear()          # to satisfy pycharm >3
     dict(kwargs).clear()
-    storage.correct([])
+    # Players still online leave right now
+    storage.reconcile([], count_playtime=True)
+    storage.flush()
 
 
 def on_unload(*args, **kwargs):
+    storage.close()
+    if stats.enabled and config.stats_dump:
+        try:
+            stats.dump(STATS_FILE)
+        except OSError as exc:
+            logger.warning(f'Failed to dump stats to {STATS_FILE}: {str(exc)}')
     logger.unset_file()
 
 
-@new_thread(psi.get_self_metadata().name + '_PluginLoad')
-def warn_first_load():
-    logger.warning('Load Seen plugin when server is empty is suggested to make sure all the datas are right')
+@new_thread(psi.get_self_metadata().name + '_PlayerList')
+def reconcile_online_players(server: PluginServerInterface):
+    """
+    Correct the stored status with the reply of the list command, queried through rcon if it's available
+    """
+    if server.is_rcon_running():
+        reply = server.rcon_query('list')
+        event = list_matcher.match(reply) if reply is not None else None
+        if event is not None:
+            storage.reconcile(split_player_list(event.name))
+            return
+    list_requested.set()
+    server.execute('list')
 
 
 def on_load(server: PluginServerInterface, prev_module):
     for prefix in config.seen_prefix:
         server.register_help_message(prefix, tr('mcd_seen.text.reg_help_msg'))
     register_command(server)
+    state = None
     if prev_module is not None:
         try:
             bot_list.clear()
             for player in prev_module.bot_list:
                 bot_list.append(player)
+            shadow_list.clear()
+            for player in getattr(prev_module, 'shadow_list', []):
+                shadow_list.append(player)
+            # Closed by its on_unload already, the state left in memory is what's on disk
+            state = prev_module.storage.handoff()
         except AttributeError:
             logger.info('Seems upgraded from a old version, welcome!')
-    else:
-        if server.is_server_running():
-            warn_first_load()
+    # Events and the list reply below queue up behind the load
+    storage.load_later(state)
+    if server.is_server_running():
+        reconcile_online_players(server)
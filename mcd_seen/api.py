@@ -0,0 +1,140 @@
+"""
+API for other plugins, reached through the plugin instance:
+
+    seen = server.get_plugin_instance('mcd_seen')
+    if seen is not None and seen.is_ready():
+        records = seen.get_players(['Steve', 'Alex'])
+
+Records are SeenRecord snapshots, immutable tuples taken under the storage lock, so a batch stays consistent
+while the plugin keeps updating. Everything is served from memory, nothing here reads the disk.
+Names are matched case-insensitively, a bot is the record named "<name>@bot"
+"""
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from mcd_seen.storage import storage, PlayerSeen
+from mcd_seen.utils import bot_name, delta_time
+
+# Bumped on incompatible changes of this module
+API_VERSION = 1
+
+
+class SeenRecord(NamedTuple):
+    name: str
+    joined: int
+    left: int
+
+    @property
+    def online(self) -> bool:
+        return self.joined > self.left
+
+    @property
+    def target(self) -> int:
+        """
+        Joined time if online, left time otherwise
+        """
+        return self.joined if self.online else self.left
+
+    @property
+    def is_bot(self) -> bool:
+        return self.name.endswith('@bot')
+
+    @property
+    def actual_name(self) -> str:
+        return self.name[:-4] if self.is_bot else self.name
+
+    @property
+    def seconds(self) -> int:
+        """
+        Seconds online if online, seconds offline otherwise
+        """
+        return delta_time(self.target)
+
+
+def __view(seen: Optional[PlayerSeen]) -> Optional[SeenRecord]:
+    return None if seen is None else SeenRecord(seen.name, seen.joined, seen.left)
+
+
+def __views(players: Iterable[PlayerSeen]) -> List[SeenRecord]:
+    return [SeenRecord(p.name, p.joined, p.left) for p in players]
+
+
+def is_ready() -> bool:
+    """
+    If the data is loaded, every query returns nothing before it
+    """
+    return storage.ready
+
+
+def get_player(name: str, bot: bool = False) -> Optional[SeenRecord]:
+    """
+    :param bot: Look up the bot named after the player instead
+    """
+    with storage.lock:
+        return __view(storage.get(bot_name(name) if bot else name))
+
+
+def get_players(names: Iterable[str], bot: bool = False) -> Dict[str, Optional[SeenRecord]]:
+    """
+    Look up many players at once
+    :return: Each name as given -> its record, None if it's never seen
+    """
+    with storage.lock:
+        return {n: __view(storage.get(bot_name(n) if bot else n)) for n in names}
+
+
+def seen_top(limit: Optional[int] = 10, offset: int = 0, bot: bool = False, _all: bool = False) -> List[SeenRecord]:
+    """
+    Offline players, the longest offline first
+    :param bot: Bots only
+    :param _all: Players and bots
+    """
+    with storage.lock:
+        return __views(storage.seen_top(bot, _all, limit, offset))
+
+
+def liver_top(limit: Optional[int] = 10, offset: int = 0, bot: bool = False, _all: bool = False) -> List[SeenRecord]:
+    """
+    Online players, the latest joined (the shortest online) first
+    """
+    with storage.lock:
+        return __views(storage.liver_top(bot, _all, limit, offset))
+
+
+def count(online: bool, bot: bool = False, _all: bool = False) -> int:
+    return storage.top_size(online, bot, _all)
+
+
+def active_since(since: int, bot: bool = False, _all: bool = False,
+                 limit: Optional[int] = None) -> Tuple[List[SeenRecord], int]:
+    """
+    Players online or left at or after timestamp since, the online ones first, then the latest left first
+    :return: The records up to limit, and the amount of them all
+    """
+    with storage.lock:
+        players, total = storage.active_since(since, bot, _all, limit)
+        return __views(players), total
+
+
+def inactive_since(since: int, bot: bool = False, _all: bool = False,
+                   limit: Optional[int] = None) -> Tuple[List[SeenRecord], int]:
+    """
+    Players offline since before timestamp since, the oldest left first
+    :return: The records up to limit, and the amount of them all
+    """
+    with storage.lock:
+        players, total = storage.inactive_since(since, bot, _all, limit)
+        return __views(players), total
+
+
+def iter_online(bot: bool = False, _all: bool = False) -> Iterator[SeenRecord]:
+    """
+    Online players as of the call, the latest joined (the shortest online) first
+    """
+    return iter(liver_top(None, bot=bot, _all=_all))
+
+
+def iter_offline(bot: bool = False, _all: bool = False) -> Iterator[SeenRecord]:
+    """
+    Offline players as of the call, the longest offline first
+    """
+    return iter(seen_top(None, bot=bot, _all=_all))
@@ -0,0 +1,545 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+
+from array import array
+from contextlib import contextmanager
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from mcd_seen.constants import SEENS_FILE, SEENS_PATH_OLD, JOURNAL_FILE, COMPACTING_JOURNAL_FILE, DATABASE_FILE, \
+    BINARY_SEENS_FILE
+from mcd_seen.config import config
+from mcd_seen.stats import stats
+from mcd_seen.snapshot import Columns, empty_columns, read_binary_snapshot, write_binary_snapshot
+from mcd_seen.utils import logger, bot_name, is_bot
+
+# name, joined, left. A record with both timestamps being 0 means the player is removed
+Record = Tuple[str, int, int]
+# name, joined, left, server
+ForeignRecord = Tuple[str, int, int, str]
+# Ranks online rows above offline ones in the shared store, timestamps stay far below it
+ONLINE_RANK = 1 << 40
+
+
+class StorageBackend:
+    """
+    Where SeenStorage persists its records, the records themselves are always served from memory
+    """
+    def load_snapshot(self) -> Columns:
+        """
+        Read the stored players as columns, each name appears only once
+        """
+        raise NotImplementedError()
+
+    def load_tail(self) -> Iterator[Record]:
+        """
+        Yield changes stored after the snapshot in order, they override the snapshot records
+        """
+        return iter(())
+
+    def load(self) -> Iterator[Record]:
+        return chain(zip(*self.load_snapshot()), self.load_tail())
+
+    def record(self, name: str, joined: int, left: int) -> bool:
+        """
+        Persist the change of a single player
+        :return: If a full snapshot save is required
+        """
+        raise NotImplementedError()
+
+    def record_many(self, records: Iterable[Record]) -> bool:
+        """
+        Persist the changes of several players in one go
+        :return: If a full snapshot save is required
+        """
+        need_save = False
+        for name, joined, left in records:
+            need_save = self.record(name, joined, left) or need_save
+        return need_save
+
+    def remove(self, name: str) -> bool:
+        """
+        Persist the removal of a player
+        :return: If a full snapshot save is required
+        """
+        return self.record(name, 0, 0)
+
+    @property
+    def has_backlog(self) -> bool:
+        """
+        If there are persisted changes that should be folded into a snapshot on flush
+        """
+        return False
+
+    @property
+    def shared(self) -> bool:
+        """
+        If other servers write into the same store, their changes are pulled with sync()
+        """
+        return False
+
+    def foreign_names(self) -> Dict[str, str]:
+        """
+        Players whose loaded record was written by another server, mapped to that server.
+        Valid right after load_snapshot()
+        """
+        return {}
+
+    def sync(self) -> List[ForeignRecord]:
+        """
+        Records written by other servers since the last load or sync, in the order they were written
+        """
+        return []
+
+    def handoff(self) -> dict:
+        """
+        State kept across plugin reloads, along with the records handed off by SeenStorage
+        """
+        return {}
+
+    def adopt(self, state: dict) -> bool:
+        """
+        :return: If the state is taken, a refused one makes the storage load from the store instead
+        """
+        return True
+
+    def prepare_save(self):
+        """
+        Called with the storage locked right after the snapshot is taken, before save()
+        """
+        pass
+
+    def save(self, records: List[Record]):
+        raise NotImplementedError()
+
+    @property
+    def needs_export(self) -> bool:
+        """
+        If export() should be called on unload
+        """
+        return False
+
+    def export(self, records: List[Record]):
+        """
+        Called on unload, keep seen.json readable for other tools if it's not the snapshot
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonBackend(StorageBackend):
+    """
+    The whole history in a snapshot file rewritten on every save,
+    seen.json or seen.bin depending on config.snapshot_format
+    """
+    @property
+    def binary(self) -> bool:
+        return config.snapshot_format == 'binary'
+
+    def __binary_is_current(self) -> bool:
+        """
+        The newer snapshot file holds the current records, whatever the format was when it's written.
+        export() gives seen.json the mtime of the seen.bin it's made from, the same records are in both then
+        and the one of the configured format is read
+        """
+        if not os.path.isfile(BINARY_SEENS_FILE):
+            return False
+        if not os.path.isfile(SEENS_FILE):
+            return True
+        binary_mtime, json_mtime = os.stat(BINARY_SEENS_FILE).st_mtime_ns, os.stat(SEENS_FILE).st_mtime_ns
+        return binary_mtime > json_mtime or (binary_mtime == json_mtime and self.binary)
+
+    def load_snapshot(self) -> Columns:
+        if self.__binary_is_current():
+            try:
+                return read_binary_snapshot(BINARY_SEENS_FILE)
+            except (OSError, ValueError) as exc:
+                logger.warning(f'Failed to read {BINARY_SEENS_FILE}, falling back to {SEENS_FILE}: {str(exc)}')
+        need_convert = False
+        if not os.path.isfile(SEENS_FILE):
+            for f in SEENS_PATH_OLD:
+                if os.path.isfile(f):
+                    shutil.move(f, SEENS_FILE)
+                    need_convert = True
+                    break
+            if not need_convert:
+                self.__save_json([])
+        with open(SEENS_FILE, 'r', encoding='UTF-8') as f:
+            to_load = json.load(f)
+        names, joined, left = empty_columns()
+        for p, s in to_load.items():
+            if need_convert and is_bot(p):
+                p = bot_name(p)
+            names.append(p)
+            joined.append(s.get('joined', 0))
+            left.append(s.get('left', 0))
+        return names, joined, left
+
+    def record(self, name: str, joined: int, left: int) -> bool:
+        return True
+
+    def save(self, records: List[Record]):
+        if self.binary:
+            write_binary_snapshot(BINARY_SEENS_FILE, self.__to_columns(records))
+        else:
+            self.__save_json(records)
+        if stats.enabled:
+            stats.count('save.bytes', os.path.getsize(BINARY_SEENS_FILE if self.binary else SEENS_FILE))
+
+    @property
+    def needs_export(self) -> bool:
+        # Nothing changed since the last export if seen.json still has the mtime of seen.bin
+        if not self.binary or not os.path.isfile(BINARY_SEENS_FILE):
+            return False
+        return not os.path.isfile(SEENS_FILE) or \
+            os.stat(BINARY_SEENS_FILE).st_mtime_ns > os.stat(SEENS_FILE).st_mtime_ns
+
+    def export(self, records: List[Record]):
+        if self.binary:
+            self.__save_json(records)
+            if os.path.isfile(BINARY_SEENS_FILE):
+                # Made from the same records, so neither one is newer
+                stat = os.stat(BINARY_SEENS_FILE)
+                os.utime(SEENS_FILE, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    @staticmethod
+    def __to_columns(records: List[Record]) -> Columns:
+        if len(records) == 0:
+            return empty_columns()
+        names, joined, left = zip(*records)
+        return list(names), array('q', joined), array('q', left)
+
+    @staticmethod
+    def __save_json(records: List[Record]):
+        to_save = {}
+        for name, joined, left in records:
+            to_save[name] = {'joined': joined, 'left': left}
+        temp_file = SEENS_FILE + '.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            json.dump(to_save, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, SEENS_FILE)
+
+
+class JournalBackend(JsonBackend):
+    """
+    A snapshot plus seen.journal with a line appended for every change
+    """
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__journal = None
+        self.__journal_size = 0
+
+    def load_tail(self) -> Iterator[Record]:
+        self.__journal_size = 0
+        yield from self.__replay(COMPACTING_JOURNAL_FILE)
+        yield from self.__replay(JOURNAL_FILE)
+
+    def __replay(self, path: str) -> Iterator[Record]:
+        if not os.path.isfile(path):
+            return
+        valid_lines = []
+        clean = True
+        with open(path, 'r', encoding='UTF-8') as f:
+            for line in f:
+                try:
+                    name, joined, left = json.loads(line)
+                except ValueError:
+                    # Torn tail from a crash
+                    logger.warning(f'Skipped broken journal line: {line.strip()}')
+                    clean = False
+                    continue
+                valid_lines.append(line)
+                self.__journal_size += 1
+                yield name, joined, left
+        if not clean:
+            # Don't append after a broken line
+            with open(path, 'w', encoding='UTF-8') as f:
+                f.writelines(valid_lines)
+
+    def record(self, name: str, joined: int, left: int) -> bool:
+        return self.record_many([(name, joined, left)])
+
+    def record_many(self, records: Iterable[Record]) -> bool:
+        lines = ''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records)
+        with self.__lock:
+            if self.__journal is None:
+                self.__journal = open(JOURNAL_FILE, 'a', encoding='UTF-8')
+            self.__journal.write(lines)
+            self.__journal.flush()
+            if stats.enabled:
+                stats.count('journal.bytes', len(lines.encode('UTF-8')))
+            self.__journal_size += lines.count('\n')
+            return self.__journal_size >= config.journal_compact_threshold
+
+    @property
+    def has_backlog(self) -> bool:
+        return self.__journal_size > 0 or os.path.isfile(JOURNAL_FILE) or os.path.isfile(COMPACTING_JOURNAL_FILE)
+
+    def prepare_save(self):
+        # Appends from now on go to a fresh journal, the old one is dropped once the snapshot is in place
+        with self.__lock:
+            self.__close_journal()
+            if os.path.isfile(JOURNAL_FILE):
+                if os.path.isfile(COMPACTING_JOURNAL_FILE):
+                    # Left by a crash before its snapshot was written, it still holds records the snapshot lacks
+                    with open(JOURNAL_FILE, 'rb') as src, open(COMPACTING_JOURNAL_FILE, 'a+b') as dst:
+                        if dst.tell() > 0:
+                            dst.seek(-1, os.SEEK_END)
+                            if dst.read(1) != b'\n':
+                                dst.write(b'\n')
+                        shutil.copyfileobj(src, dst)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(JOURNAL_FILE)
+                else:
+                    os.replace(JOURNAL_FILE, COMPACTING_JOURNAL_FILE)
+            self.__journal_size = 0
+
+    def save(self, records: List[Record]):
+        super().save(records)
+        if os.path.isfile(COMPACTING_JOURNAL_FILE):
+            os.remove(COMPACTING_JOURNAL_FILE)
+
+    def __close_journal(self):
+        with self.__lock:
+            if self.__journal is not None:
+                self.__journal.close()
+                self.__journal = None
+
+    def close(self):
+        self.__close_journal()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    One row per player in seen.db, every change is a single row write
+    """
+    def __init__(self, path: str = DATABASE_FILE):
+        self.__lock = threading.RLock()
+        migrate = not os.path.isfile(path)
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        with self.__conn:
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS seen ('
+                'name TEXT PRIMARY KEY, joined INTEGER NOT NULL DEFAULT 0, "left" INTEGER NOT NULL DEFAULT 0)'
+            )
+            # Reads are all served from memory, an index besides the primary key would only slow the writes down.
+            # Dropped from the databases made by earlier versions
+            for index in ('seen_lower_name', 'seen_left', 'seen_joined'):
+                self.__conn.execute(f'DROP INDEX IF EXISTS {index}')
+        if migrate:
+            self.migrate()
+
+    def migrate(self):
+        """
+        Import seen.json, the legacy seen file locations and a pending journal into the database
+        """
+        if not any(os.path.isfile(f) for f in [SEENS_FILE, BINARY_SEENS_FILE] + SEENS_PATH_OLD):
+            return
+        records = {}
+        for name, joined, left in JournalBackend().load():
+            records[name] = (name, joined, left)
+        self.save(records.values())
+        logger.info(f'Migrated {len(records)} players from {SEENS_FILE} to {DATABASE_FILE}')
+
+    def load_snapshot(self) -> Columns:
+        with self.__lock:
+            rows = self.__conn.execute('SELECT name, joined, "left" FROM seen').fetchall()
+        if len(rows) == 0:
+            return empty_columns()
+        names, joined, left = zip(*rows)
+        return list(names), array('q', joined), array('q', left)
+
+    def record(self, name: str, joined: int, left: int) -> bool:
+        return self.record_many([(name, joined, left)])
+
+    def record_many(self, records: Iterable[Record]) -> bool:
+        records = list(records)
+        with self.__lock, self.__conn:
+            self.__conn.executemany('DELETE FROM seen WHERE name = ?', [(r[0],) for r in records if r[1] == r[2] == 0])
+            self.__conn.executemany(
+                'INSERT OR REPLACE INTO seen (name, joined, "left") VALUES (?, ?, ?)',
+                [r for r in records if not r[1] == r[2] == 0]
+            )
+        return False
+
+    def save(self, records: Iterable[Record]):
+        with self.__lock, self.__conn:
+            self.__conn.execute('DELETE FROM seen')
+            self.__conn.executemany(
+                'INSERT OR REPLACE INTO seen (name, joined, "left") VALUES (?, ?, ?)',
+                (r for r in records if not r[1] == r[2] == 0)
+            )
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+class SharedSQLiteBackend(StorageBackend):
+    """
+    Records of several servers in one SQLite database in WAL mode, one row per player and server.
+    Every write takes a version from a counter shared by all the servers, so each of them only reads
+    the rows written by the others since the last version it has seen.
+    The record of a player is the one with the latest target among the servers, online ones first
+    """
+    def __init__(self, path: str, server: str):
+        self.path = path
+        self.server = server
+        self.__lock = threading.RLock()
+        # Latest version read from the other servers
+        self.__cursor = 0
+        self.__foreign = {}         # type: Dict[str, str]
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Transactions are started by hand, BEGIN IMMEDIATE keeps versions in commit order across processes
+        self.__conn = sqlite3.connect(
+            path, timeout=config.shared_busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self.__conn.execute(f'PRAGMA busy_timeout={int(config.shared_busy_timeout * 1000)}')
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        with self.__transaction():
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS seen_shared ('
+                'server TEXT NOT NULL, name TEXT NOT NULL, joined INTEGER NOT NULL DEFAULT 0, '
+                '"left" INTEGER NOT NULL DEFAULT 0, version INTEGER NOT NULL, PRIMARY KEY (server, name))'
+            )
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS seen_shared_version ON seen_shared (version)')
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS seen_shared_name ON seen_shared (name)')
+            migrate = self.__conn.execute(
+                'SELECT 1 FROM seen_shared WHERE server = ? LIMIT 1', (server,)
+            ).fetchone() is None
+        if migrate:
+            self.migrate()
+
+    @contextmanager
+    def __transaction(self, immediate: bool = False):
+        with self.__lock:
+            self.__conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield
+            except BaseException:
+                self.__conn.execute('ROLLBACK')
+                raise
+            self.__conn.execute('COMMIT')
+
+    def migrate(self):
+        """
+        Import the records this server kept on its own, in seen.db or the snapshot and journal
+        """
+        if os.path.isfile(DATABASE_FILE):
+            source = SQLiteBackend(DATABASE_FILE)
+            records = list(source.load())
+            source.close()
+        elif any(os.path.isfile(f) for f in [SEENS_FILE, BINARY_SEENS_FILE] + SEENS_PATH_OLD):
+            records = list({r[0]: r for r in JournalBackend().load()}.values())
+        else:
+            return
+        self.record_many(records)
+        logger.info(f'Imported {len(records)} players into {self.path} as server {self.server}')
+
+    @property
+    def shared(self) -> bool:
+        return True
+
+    def load_snapshot(self) -> Columns:
+        with self.__transaction():
+            # The bare columns come from the row with the greatest rank of each name
+            rows = self.__conn.execute(
+                'SELECT name, joined, "left", server, MAX((joined > "left") * ? + MAX(joined, "left")) '
+                'FROM seen_shared WHERE joined != 0 OR "left" != 0 GROUP BY name',
+                (ONLINE_RANK,)
+            ).fetchall()
+            self.__cursor = self.__conn.execute('SELECT COALESCE(MAX(version), 0) FROM seen_shared').fetchone()[0]
+        self.__foreign = {r[0]: r[3] for r in rows if r[3] != self.server}
+        if len(rows) == 0:
+            return empty_columns()
+        names, joined, left = list(zip(*rows))[:3]
+        return list(names), array('q', joined), array('q', left)
+
+    def foreign_names(self) -> Dict[str, str]:
+        return self.__foreign
+
+    def sync(self) -> List[ForeignRecord]:
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT name, joined, "left", server, version FROM seen_shared WHERE version > ? AND server != ? '
+                'ORDER BY version',
+                (self.__cursor, self.server)
+            ).fetchall()
+            if len(rows) > 0:
+                self.__cursor = rows[-1][4]
+        return [row[:4] for row in rows]
+
+    def record(self, name: str, joined: int, left: int) -> bool:
+        return self.record_many([(name, joined, left)])
+
+    def record_many(self, records: Iterable[Record]) -> bool:
+        records = list(records)
+        if len(records) == 0:
+            return False
+        with self.__transaction(immediate=True):
+            version = self.__conn.execute('SELECT COALESCE(MAX(version), 0) FROM seen_shared').fetchone()[0]
+            # A removal clears the records of every server, the tombstone tells the others to drop it too
+            self.__conn.executemany(
+                'DELETE FROM seen_shared WHERE name = ? AND server != ?',
+                [(r[0], self.server) for r in records if r[1] == r[2] == 0]
+            )
+            self.__conn.executemany(
+                'INSERT OR REPLACE INTO seen_shared (server, name, joined, "left", version) VALUES (?, ?, ?, ?, ?)',
+                [(self.server, name, joined, left, version + i) for i, (name, joined, left) in enumerate(records, 1)]
+            )
+        return False
+
+    def save(self, records: List[Record]):
+        # Every change is written by record(), a snapshot would claim the records of the other servers
+        pass
+
+    def handoff(self) -> dict:
+        with self.__lock:
+            return {'path': self.path, 'server': self.server, 'cursor': self.__cursor}
+
+    def adopt(self, state: dict) -> bool:
+        if state.get('path') != self.path or state.get('server') != self.server:
+            return False
+        with self.__lock:
+            self.__cursor = state['cursor']
+        return True
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+def server_name() -> str:
+    """
+    Name of this server in the shared store, the MCDR folder name unless set in config
+    """
+    return config.server_name or os.path.basename(os.getcwd())
+
+
+def create_backend() -> StorageBackend:
+    mode = config.storage_mode
+    if mode == 'journal':
+        return JournalBackend()
+    if mode == 'sqlite':
+        return SQLiteBackend()
+    if mode == 'shared':
+        if config.shared_database:
+            return SharedSQLiteBackend(config.shared_database, server_name())
+        logger.warning('Storage mode "shared" requires shared_database, using sqlite')
+        return SQLiteBackend()
+    if mode != 'json':
+        logger.warning(f'Unknown storage mode "{mode}", using json')
+    return JsonBackend()
@@ -0,0 +1,159 @@
+import sys
+
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mcd_seen.utils import now_time
+
+
+class SeenMixin:
+    """
+    Player state behaviours shared by PlayerSeen and CompactSeen, based on name, joined and left
+    """
+    __slots__ = ()
+    name: str
+    joined: int
+    left: int
+
+    @property
+    def online(self):
+        return self.joined > self.left
+
+    def join(self):
+        self.joined = now_time()
+
+    def leave(self):
+        self.left = now_time()
+        if self.joined == 0:
+            self.joined = now_time() - 1
+
+    @property
+    def actual_name(self):
+        return self.name[:-4] if self.is_bot else self.name
+
+    @property
+    def is_bot(self):
+        return self.name.endswith('@bot')
+
+    @property
+    def target(self) -> int:
+        return self.joined if self.online else self.left
+
+    @property
+    def is_empty(self):
+        return self.joined == self.left == 0
+
+
+class CompactSeen(SeenMixin):
+    """
+    Lightweight view of a record in CompactRecords, changes are written back to the columns
+    """
+    __slots__ = ('__records', '__slot')
+
+    def __init__(self, records: 'CompactRecords', slot: int):
+        self.__records = records
+        self.__slot = slot
+
+    @property
+    def name(self) -> str:
+        return self.__records.names[self.__slot]
+
+    @property
+    def joined(self) -> int:
+        return self.__records.joined[self.__slot]
+
+    @joined.setter
+    def joined(self, value: int):
+        self.__records.joined[self.__slot] = value
+
+    @property
+    def left(self) -> int:
+        return self.__records.left[self.__slot]
+
+    @left.setter
+    def left(self, value: int):
+        self.__records.left[self.__slot] = value
+
+    def serialize(self) -> dict:
+        return {'joined': self.joined, 'left': self.left}
+
+
+class CompactRecords(MutableMapping):
+    """
+    Name -> record mapping keeping interned names and joined/left timestamps in columns instead of an object per player
+    """
+    def __init__(self):
+        self.names = []             # type: List[Optional[str]]
+        self.joined = array('q')
+        self.left = array('q')
+        self.__slots = {}           # type: Dict[str, int]
+        self.__free = []            # type: List[int]
+
+    def put(self, name: str, joined: int, left: int):
+        slot = self.__slots.get(name)
+        if slot is None:
+            name = sys.intern(name)
+            if len(self.__free) > 0:
+                slot = self.__free.pop()
+                self.names[slot], self.joined[slot], self.left[slot] = name, joined, left
+            else:
+                slot = len(self.names)
+                self.names.append(name)
+                self.joined.append(joined)
+                self.left.append(left)
+            self.__slots[name] = slot
+        else:
+            self.joined[slot], self.left[slot] = joined, left
+
+    def extend(self, names: List[str], joined: array, left: array):
+        """
+        Add players in bulk, the columns are adopted as they are if there is nothing stored yet
+        """
+        if len(self.__slots) > 0:
+            for name, j, l in zip(names, joined, left):
+                self.put(name, j, l)
+            return
+        self.names = list(map(sys.intern, names))
+        self.joined, self.left = joined, left
+        self.__slots = dict(zip(self.names, range(len(self.names))))
+        self.__free = []
+
+    def state(self) -> tuple:
+        """
+        Internals in builtins and arrays, to be adopted by the instance from a reloaded module
+        """
+        return self.names, self.joined, self.left, self.__slots, self.__free
+
+    def adopt(self, state: tuple):
+        self.names, self.joined, self.left, self.__slots, self.__free = state
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[str, int, int]]:
+        """
+        Iterate (name, joined, left) straight from the columns, of the slots from start to stop if given
+        """
+        if start == 0 and stop is None:
+            columns = self.names, self.joined, self.left
+        else:
+            columns = self.names[start:stop], self.joined[start:stop], self.left[start:stop]
+        return ((n, j, l) for n, j, l in zip(*columns) if n is not None)
+
+    def __getitem__(self, name: str) -> CompactSeen:
+        return CompactSeen(self, self.__slots[name])
+
+    def __setitem__(self, name: str, value: SeenMixin):
+        self.put(name, value.joined, value.left)
+
+    def __delitem__(self, name: str):
+        slot = self.__slots.pop(name)
+        self.names[slot] = None
+        self.__free.append(slot)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.__slots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots)
+
+    def __len__(self) -> int:
+        return len(self.__slots)
@@ -5,20 +5,83 @@ from mcdreforged.api.utils import Serializable
 from mcdreforged.api.types import ServerInterface
 
 from mcd_seen.constants import CONFIG_FILE
+from mcd_seen.matcher import DEFAULT_PATTERNS
 
 
 psi = ServerInterface.get_instance().as_plugin_server_interface()
 
 
+class LinePattern(Serializable):
+    event: str = 'join'
+    contains: str = ''
+    regex: str = ''
+    bot: bool = False
+
+
 class Config(Serializable):
     primary_prefix: Union[str, List[str]] = '!!seen'
     primary_rank_prefix: Union[str, List[str]] = '!!seen-top'
     secondary_rank_prefix: Union[str, List[str]] = '!!liver-top'
+    playtime_rank_prefix: Union[str, List[str]] = '!!seen-playtime'
+    active_prefix: Union[str, List[str]] = '!!seen-active'
+    inactive_prefix: Union[str, List[str]] = '!!seen-since'
     seen_top_max: int = 10
+    # Default rows per page of the -full ranks, and the most rows a page can have with -size
+    full_page_size: int = 50
+    max_page_size: int = 200
     player_prior_in_merge: bool = True
+    # Days of daily playtime kept for the windowed playtime ranks, also the longest window allowed
+    playtime_window_days: int = 30
+    # Sessions are appended to sessions.log at once, playtime.json is only rewritten after this many sessions and on
+    # flush. sessions.log is rotated to sessions.log.old once it's bigger than sessions_log_rotate_size bytes
+    playtime_save_sessions: int = 100
+    sessions_log_rotate_size: int = 4 * 1024 * 1024
     log_seens: bool = True
+    # logs/seen.log is written in the background every log_flush_interval seconds or once log_buffer_lines lines
+    # are waiting, and rotated daily or at log_rotate_size bytes. Rotated logs are gzipped and removed after
+    # log_retention_days days, 0 keeps them forever. The history of older versions in old_seens.log.gz is always kept
+    log_flush_interval: float = 5.0
+    log_buffer_lines: int = 100
+    log_rotate_size: int = 4 * 1024 * 1024
+    log_retention_days: int = 90
     identify_bot: bool = True
-    bot_list_delay: float = 0.3
+    # Names converted as bots when upgrading from the legacy seen.json, matched case-insensitively
+    bot_blacklist: List[str] = [
+        'A_Pi', 'nw', 'sw', 'SE', 'ne', 'nf', 'SandWall', 'storage', 'Steve', 'Alex', 'DuperMaster', 'Nya_Vanilla',
+        'Witch', 'Klio_5'
+    ]
+    bot_keywords: List[str] = [r'farm', r'bot_', r'cam', r'_b_', r'bot-', r'bot\d', r'^bot']
+    # Join lines, used when identify_bot is on. Tried in order, a line is matched against regex only if it contains
+    # "contains". Leaves always come from the player left event of MCDR
+    log_patterns: List[LinePattern] = [
+        LinePattern(event=e, contains=c, regex=r, bot=b) for e, c, r, b in DEFAULT_PATTERNS
+    ]
+    # 'json' rewrites seen.json on every event, 'journal' appends to seen.journal and compacts it periodically,
+    # 'sqlite' writes a single row to seen.db per event, 'shared' writes a row to the SQLite database at
+    # shared_database used by the other servers of the network too, tagged with server_name (the MCDR folder name
+    # if empty). Changes of the other servers are pulled every shared_sync_interval seconds, writers wait up to
+    # shared_busy_timeout seconds for each other
+    storage_mode: str = 'json'
+    journal_compact_threshold: int = 1000
+    shared_database: str = ''
+    server_name: str = ''
+    shared_sync_interval: float = 5.0
+    shared_busy_timeout: float = 10.0
+    # Snapshot of 'json' and 'journal' mode, 'binary' loads much faster and exports seen.json on unload
+    snapshot_format: str = 'json'
+    # Keep records in array columns instead of an object per player. It saves little in total: at 100k players both
+    # layouts take about 83 MB, most of it held by the leaderboards and name indexes either way
+    compact_records: bool = False
+    # Seconds to gather changes before the background writer rewrites the snapshot
+    save_interval: float = 1.0
+    # World folder "!!seen import" reads player files from, the level-name of server.properties in the MCDR working
+    # directory if empty. backfill_workers threads scan the folders, 0 picks a count from the CPUs
+    backfill_world: str = ''
+    backfill_workers: int = 0
+    # Collect counters and latencies shown by "!!seen stats", takes effect on plugin reload.
+    # stats_dump writes them to stats.json on unload
+    stats: bool = False
+    stats_dump: bool = False
     verbosity: bool
     debug_commands: bool
     debug_prefixes: Union[str, List[str]]
@@ -41,6 +104,18 @@ class Config(Serializable):
     def liver_top_prefix(self):
         return self.get_iterable(self.secondary_rank_prefix)
 
+    @property
+    def playtime_prefix(self):
+        return self.get_iterable(self.playtime_rank_prefix)
+
+    @property
+    def seen_active_prefix(self):
+        return self.get_iterable(self.active_prefix)
+
+    @property
+    def seen_since_prefix(self):
+        return self.get_iterable(self.inactive_prefix)
+
     @property
     def debug_prefix(self):
         return self.get_iterable(self.serialize().get('debug_prefixes', '!!liver'))
@@ -48,10 +123,17 @@ class Config(Serializable):
     @property
     def prefixes(self):
         result = []
-        for item in [self.seen_prefix, self.seen_top_prefix, self.liver_top_prefix]:
+        for item in [
+            self.seen_prefix, self.seen_top_prefix, self.liver_top_prefix, self.playtime_prefix,
+            self.seen_active_prefix, self.seen_since_prefix
+        ]:
             result += item
         return result
 
+    @property
+    def line_patterns(self):
+        return [(p.event, p.contains, p.regex, p.bot) for p in self.log_patterns]
+
     @property
     def verbose_mode(self):
         return self.serialize().get('verbosity', False)
@@ -11,6 +11,14 @@ def ensure(folder: str):
 DATA_FOLDER = ensure('config/seen')
 CONFIG_FILE = os.path.join(DATA_FOLDER, 'config.json')
 SEENS_FILE = os.path.join(DATA_FOLDER, 'seen.json')
+BINARY_SEENS_FILE = os.path.join(DATA_FOLDER, 'seen.bin')
+JOURNAL_FILE = os.path.join(DATA_FOLDER, 'seen.journal')
+COMPACTING_JOURNAL_FILE = JOURNAL_FILE + '.compacting'
+DATABASE_FILE = os.path.join(DATA_FOLDER, 'seen.db')
+SESSIONS_FILE = os.path.join(DATA_FOLDER, 'sessions.log')
+PLAYTIME_FILE = os.path.join(DATA_FOLDER, 'playtime.json')
+STATS_FILE = os.path.join(DATA_FOLDER, 'stats.json')
+EXPORT_FOLDER = os.path.join(DATA_FOLDER, 'exports')
 LOG_FILE = os.path.join(DATA_FOLDER, 'logs', 'seen.log')
 SEENS_PATH_OLD = ['seen.json', 'config/seen.json']
 OLD_LOG_FILE = os.path.join(DATA_FOLDER, 'player_seens.log')
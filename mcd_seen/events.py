@@ -0,0 +1,99 @@
+import queue
+import threading
+
+from concurrent.futures import Future
+
+from typing import Any, Callable, Optional
+
+from mcdreforged.api.decorator import new_thread
+
+from mcd_seen.utils import logger, psi
+
+
+class EventQueue:
+    """
+    Applies submitted calls one by one in submission order on a single consumer thread
+    """
+    __STOP = object()
+
+    def __init__(self):
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__stopped = False
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        :return: Resolved with the return value once the call is applied, cancelled if the queue is stopped
+        """
+        future = Future()
+        if self.__stopped:
+            logger.warning(f'Event queue already stopped, dropped call to {func.__name__}')
+            future.cancel()
+            return future
+        self.__queue.put((future, func, args, kwargs))
+        with self.__lock:
+            if not self.__running:
+                self.__running = True
+                self.__consume()
+        return future
+
+    def wait_until_drained(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every submitted call has been applied
+        :param timeout: Give up after this many seconds
+        :return: If the queue is drained
+        """
+        with self.__queue.all_tasks_done:
+            return self.__queue.all_tasks_done.wait_for(lambda: self.__queue.unfinished_tasks == 0, timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Apply the calls still queued and stop the consumer thread
+        """
+        with self.__lock:
+            self.__stopped = True
+            if self.__running:
+                self.__queue.put(self.__STOP)
+        return self.wait_until_drained(timeout)
+
+    @new_thread(psi.get_self_metadata().name + '_EventQueue')
+    def __consume(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is self.__STOP:
+                    with self.__lock:
+                        self.__running = False
+                    return
+                future, func, args, kwargs = item
+                future.set_result(func(*args, **kwargs))
+            except Exception as exc:
+                logger.exception('Error occurred while applying seen event')
+                future.set_exception(exc)
+            finally:
+                self.__queue.task_done()
+
+
+class Ticker:
+    """
+    Calls a function every interval seconds on a background thread until stopped
+    """
+    def __init__(self, interval: float, func: Callable[[], Any]):
+        self.__interval = interval
+        self.__func = func
+        self.__stopped = threading.Event()
+
+    def start(self):
+        self.__run()
+
+    def stop(self):
+        self.__stopped.set()
+
+    @new_thread(psi.get_self_metadata().name + '_Ticker')
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            try:
+                self.__func()
+            except Exception:
+                logger.exception(f'Error occurred while calling {self.__func.__name__}')
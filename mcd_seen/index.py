@@ -0,0 +1,225 @@
+import heapq
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class SortedIndex:
+    """
+    Names kept ordered by an integer key, ties are ordered by name
+    """
+    def __init__(self):
+        self.__items = []       # type: List[Tuple[int, str]]
+        self.__keys = {}        # type: Dict[str, int]
+
+    def add(self, name: str, key: int):
+        self.remove(name)
+        self.__keys[name] = key
+        insort(self.__items, (key, name))
+
+    def remove(self, name: str) -> bool:
+        key = self.__keys.pop(name, None)
+        if key is None:
+            return False
+        del self.__items[bisect_left(self.__items, (key, name))]
+        return True
+
+    def rebuild(self, items: Iterable[Tuple[str, int]]):
+        self.__keys = dict(items)
+        self.__items = sorted((k, n) for n, k in self.__keys.items())
+
+    def state(self) -> tuple:
+        """
+        Internals in builtins, to be adopted by the instance from a reloaded module
+        """
+        return self.__items, self.__keys
+
+    def adopt(self, state: tuple):
+        self.__items, self.__keys = state
+
+    def ascending(self) -> Iterator[Tuple[int, str]]:
+        return iter(self.__items)
+
+    def descending(self) -> Iterator[Tuple[int, str]]:
+        return reversed(self.__items)
+
+    def slice(self, offset: int = 0, limit: Optional[int] = None, reverse: bool = False) -> List[Tuple[int, str]]:
+        """
+        Items from position offset in ascending, or descending if reverse, order, only the slice is copied
+        """
+        if not reverse:
+            return self.__items[offset:None if limit is None else offset + limit]
+        end = len(self.__items) - offset
+        if end <= 0:
+            return []
+        start = 0 if limit is None else max(end - limit, 0)
+        return self.__items[start:end][::-1]
+
+    def __bounds(self, low: Optional[int], high: Optional[int]) -> Tuple[int, int]:
+        # (key,) sorts before every (key, name)
+        start = 0 if low is None else bisect_left(self.__items, (low,))
+        end = len(self.__items) if high is None else bisect_left(self.__items, (high,), lo=start)
+        return start, end
+
+    def between(self, low: Optional[int] = None, high: Optional[int] = None, limit: Optional[int] = None,
+                reverse: bool = False) -> List[Tuple[int, str]]:
+        """
+        Items with low <= key < high in ascending, or descending if reverse, order, found by bisect
+        """
+        start, end = self.__bounds(low, high)
+        if not reverse:
+            return self.__items[start:end if limit is None else min(end, start + limit)]
+        return self.__items[start if limit is None else max(start, end - limit):end][::-1]
+
+    def count_between(self, low: Optional[int] = None, high: Optional[int] = None) -> int:
+        start, end = self.__bounds(low, high)
+        return end - start
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__keys
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+
+class LeaderBoards:
+    """
+    Seen targets partitioned into online/offline and bot/player boards
+    """
+    def __init__(self):
+        self.__boards = {}      # type: Dict[Tuple[bool, bool], SortedIndex]
+        self.__located = {}     # type: Dict[str, SortedIndex]
+        for online in (False, True):
+            for bot in (False, True):
+                self.__boards[(online, bot)] = SortedIndex()
+
+    def add(self, name: str, online: bool, bot: bool, target: int):
+        self.discard(name)
+        board = self.__boards[(online, bot)]
+        self.__located[name] = board
+        board.add(name, target)
+
+    def discard(self, name: str):
+        board = self.__located.pop(name, None)
+        if board is not None:
+            board.remove(name)
+
+    def rebuild(self, items: Iterable[Tuple[str, bool, bool, int]]):
+        grouped = {}    # type: Dict[Tuple[bool, bool], List[Tuple[str, int]]]
+        self.__located = {}
+        for board in self.__boards.keys():
+            grouped[board] = []
+        for name, online, bot, target in items:
+            self.__located[name] = self.__boards[(online, bot)]
+            grouped[(online, bot)].append((name, target))
+        for board, board_items in grouped.items():
+            self.__boards[board].rebuild(board_items)
+
+    def state(self) -> dict:
+        return {board: index.state() for board, index in self.__boards.items()}
+
+    def adopt(self, state: dict):
+        self.__located = {}
+        for board, index in self.__boards.items():
+            index.adopt(state[board])
+            for name in index.state()[1].keys():
+                self.__located[name] = index
+
+    def __parts(self, online: bool, bot: bool, _all: bool) -> List[SortedIndex]:
+        return [self.__boards[(online, b)] for b in ((False, True) if _all else (bot,))]
+
+    def top(self, online: bool, bot: bool = False, _all: bool = False, limit: Optional[int] = None,
+            offset: int = 0) -> Iterator[str]:
+        """
+        Iterate names on the boards, oldest target first for offline boards and latest first for online boards
+        :param online: Read online boards instead of offline ones
+        :param bot: Read the bot board instead of the player one
+        :param _all: Read both bot and player boards
+        :param limit: Stop after this amount of names
+        :param offset: Skip this amount of names first
+        """
+        parts = self.__parts(online, bot, _all)
+        if len(parts) == 1:
+            return (name for _, name in parts[0].slice(offset, limit, reverse=online))
+        iterators = [p.descending() if online else p.ascending() for p in parts]
+        merged = heapq.merge(*iterators, reverse=online)
+        return (name for _, name in islice(merged, offset, None if limit is None else offset + limit))
+
+    def count(self, online: bool, bot: bool = False, _all: bool = False) -> int:
+        return sum(len(p) for p in self.__parts(online, bot, _all))
+
+    def between(self, online: bool, bot: bool = False, _all: bool = False, low: Optional[int] = None,
+                high: Optional[int] = None, limit: Optional[int] = None, reverse: bool = False) -> Iterator[str]:
+        """
+        Iterate names on the boards with low <= target < high, oldest target first or latest first if reverse
+        """
+        parts = [p.between(low, high, limit, reverse) for p in self.__parts(online, bot, _all)]
+        merged = parts[0] if len(parts) == 1 else heapq.merge(*parts, reverse=reverse)
+        return (name for _, name in islice(merged, limit))
+
+    def count_between(self, online: bool, bot: bool = False, _all: bool = False, low: Optional[int] = None,
+                      high: Optional[int] = None) -> int:
+        return sum(p.count_between(low, high) for p in self.__parts(online, bot, _all))
+
+
+class PrefixIndex:
+    """
+    Case-insensitive names kept sorted for prefix lookups, a name is kept until all the records using it are gone
+    """
+    def __init__(self):
+        self.__keys = []        # type: List[str]
+        # lower-cased name -> (displayed name, amount of records using it)
+        self.__names = {}       # type: Dict[str, Tuple[str, int]]
+
+    def add(self, name: str):
+        lower = name.lower()
+        current = self.__names.get(lower)
+        if current is None:
+            insort(self.__keys, lower)
+            self.__names[lower] = (name, 1)
+        else:
+            self.__names[lower] = (name, current[1] + 1)
+
+    def discard(self, name: str):
+        lower = name.lower()
+        current = self.__names.get(lower)
+        if current is None:
+            return
+        if current[1] > 1:
+            self.__names[lower] = (current[0], current[1] - 1)
+        else:
+            del self.__names[lower]
+            del self.__keys[bisect_left(self.__keys, lower)]
+
+    def rebuild(self, names: Iterable[str]):
+        self.__names = {}
+        for name in names:
+            lower = name.lower()
+            current = self.__names.get(lower)
+            self.__names[lower] = (name, 1 if current is None else current[1] + 1)
+        self.__keys = sorted(self.__names.keys())
+
+    def state(self) -> tuple:
+        return self.__keys, self.__names
+
+    def adopt(self, state: tuple):
+        self.__keys, self.__names = state
+
+    def prefixed(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Names starting with prefix case-insensitively, in alphabetical order
+        """
+        prefix = prefix.lower()
+        start = bisect_left(self.__keys, prefix)
+        # Every key starting with prefix sorts before prefix + the largest code point
+        end = bisect_right(self.__keys, prefix + '\U0010ffff', lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self.__names[k][0] for k in self.__keys[start:end]]
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.__names
+
+    def __len__(self) -> int:
+        return len(self.__keys)
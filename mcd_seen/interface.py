@@ -1,13 +1,21 @@
+import os
+import time
+
+from concurrent.futures import CancelledError
 from typing import Callable, Any, List, Union, Optional
 
 from mcdreforged.api.command import *
+from mcdreforged.api.decorator import new_thread
 from mcdreforged.api.rtext import *
 from mcdreforged.api.types import CommandSource, PluginServerInterface
 from mcdreforged.api.utils import Serializable
 
 from mcd_seen.config import config
+from mcd_seen.constants import EXPORT_FOLDER
 from mcd_seen.storage import storage, PlayerSeen
-from mcd_seen.utils import tr, delta_time, bot_name, psi, ntr, htr, fmt_time_tr
+from mcd_seen.transfer import EXPORT_FORMATS, collect_last_seen, export_file, world_folder
+from mcd_seen.stats import stats
+from mcd_seen.utils import tr, delta_time, bot_name, psi, ctr, htr, fmt_time_tr, now_time, parse_duration, logger
 
 TOP_OPTIONS = {
         '-bot': 'bot',
@@ -15,6 +23,13 @@ TOP_OPTIONS = {
         '-merge': 'merge',
         '-full': 'full'
     }
+# Most player names suggested for the player argument of !!seen
+SUGGESTION_LIMIT = 50
+# Options followed by a positive integer, they imply -full
+PAGE_OPTIONS = {
+        '-page': 'page',
+        '-size': 'page_size'
+    }
 
 
 class ExtraArguments(Serializable):
@@ -22,6 +37,8 @@ class ExtraArguments(Serializable):
     all: bool = False
     merge: bool = False
     full: bool = False
+    page: int = 1
+    page_size: int = 0
 
     @classmethod
     def parse(cls, arg_string: Optional[str], liver: bool = False):
@@ -33,9 +50,19 @@ class ExtraArguments(Serializable):
             if arg in args:
                 data[mode] = True
                 args.remove(arg)
+        for arg, mode in PAGE_OPTIONS.items():
+            if arg in args:
+                index = args.index(arg)
+                try:
+                    data[mode] = int(args[index + 1])
+                except (IndexError, ValueError):
+                    raise IllegalArgument(f'Illegal argument: {arg_string}', 1)
+                del args[index:index + 2]
+                data['full'] = True
         data = cls.deserialize(data)
         # Conflict check
-        if [data.all, data.merge, data.bot].count(True) > 1 or (data.full and liver) or (len(args) != 0):
+        if [data.all, data.merge, data.bot].count(True) > 1 or (data.full and liver) or (len(args) != 0) or \
+                data.page < 1 or data.page_size < 0 or data.page_size > config.max_page_size:
             raise IllegalArgument(f'Illegal argument: {arg_string}', 1)
         if liver and not data.get_all:
             data.all = True
@@ -45,11 +72,25 @@ class ExtraArguments(Serializable):
     def get_all(self):
         return self.all or self.merge
 
+    @property
+    def size(self) -> int:
+        return self.page_size if self.page_size > 0 else min(config.full_page_size, config.max_page_size)
+
+    def page_command(self, page: int) -> str:
+        ret = [config.seen_top_prefix[0]]
+        for arg, mode in TOP_OPTIONS.items():
+            if getattr(self, mode):
+                ret.append(arg)
+        ret += ['-page', str(page)]
+        if self.page_size > 0:
+            ret += ['-size', str(self.page_size)]
+        return ' '.join(ret)
+
     @property
     def text(self):
         ret = []
-        for o, value in self.serialize().items():
-            if value and not o == 'full':
+        for o in TOP_OPTIONS.values():
+            if getattr(self, o) and not o == 'full':
                 ret.append(tr(f'text.top_{o}'))
         if len(ret) == 0:
             ret.append(tr('text.top_normal'))
@@ -63,9 +104,16 @@ def reload_self(source: CommandSource):
 
 def register_command(server: PluginServerInterface):
     def exe(func: Union[Callable[[CommandSource, str], Any], Callable[[CommandSource], Any]], single=False):
+        func = stats.timed(f'command.{func.__name__}')(func)
+
+        def gated(src: CommandSource, **kwargs):
+            if not storage.ready:
+                storage_not_ready(src)
+                return
+            return func(src, **kwargs)
         if single:
-            return lambda src: func(src)
-        return lambda src, ctx: func(src, **ctx)
+            return lambda src: gated(src)
+        return lambda src, ctx: gated(src, **ctx)
 
     # !!seen
     server.register_command(
@@ -73,7 +121,23 @@ def register_command(server: PluginServerInterface):
             CommandError, cmd_error, handled=True).runs(show_help).then(
             Literal('reload').runs(reload_self)
         ).then(
-            QuotableText('player').runs(exe(seen))
+            Literal('stats').requires(
+                lambda src: src.has_permission(3), lambda: tr('error.permission_denied')).on_error(
+                RequirementNotMet, permission_denied, handled=True).runs(exe(show_stats, True)).then(
+                Literal('reset').runs(exe(reset_stats, True))
+            )
+        ).then(
+            Literal('export').requires(
+                lambda src: src.has_permission(3), lambda: tr('error.permission_denied')).on_error(
+                RequirementNotMet, permission_denied, handled=True).runs(exe(export_data, True)).then(
+                Text('fmt').runs(exe(export_data))
+            )
+        ).then(
+            Literal('import').requires(
+                lambda src: src.has_permission(3), lambda: tr('error.permission_denied')).on_error(
+                RequirementNotMet, permission_denied, handled=True).runs(exe(backfill, True))
+        ).then(
+            QuotableText('player').suggests(suggest_player).runs(exe(seen))
         )
     )
     # !!seen-top
@@ -90,6 +154,31 @@ def register_command(server: PluginServerInterface):
             QuotableText('exarg').runs(exe(liver_top))
         )
     )
+    # !!seen-playtime
+    server.register_command(
+        Literal(config.playtime_prefix).on_child_error(
+            CommandError, cmd_error, handled=True).runs(exe(playtime_top, True)).then(
+            Integer('days').in_range(1, config.playtime_window_days).runs(exe(playtime_top))
+        )
+    )
+    # !!seen-active
+    server.register_command(
+        Literal(config.seen_active_prefix).on_child_error(
+            CommandError, cmd_error, handled=True).runs(exe(daily_active, True)).then(
+            Literal('daily').runs(exe(daily_active, True)).then(
+                Integer('days').in_range(1, config.playtime_window_days).runs(exe(daily_active))
+            )
+        ).then(
+            GreedyText('exarg').runs(exe(seen_active))
+        )
+    )
+    # !!seen-since
+    server.register_command(
+        Literal(config.seen_since_prefix).on_child_error(
+            CommandError, cmd_error, handled=True).runs(cmd_error).then(
+            GreedyText('exarg').runs(exe(seen_since))
+        )
+    )
     if config.debug:
         server.register_command(
             Literal(config.debug_prefix).requires(
@@ -109,14 +198,73 @@ def show_help(source: CommandSource):
         config.seen_top_prefix[0],
         config.liver_top_prefix[0],
         meta.name,
-        str(meta.version)
+        str(meta.version),
+        config.playtime_prefix[0],
+        config.playtime_window_days,
+        config.seen_active_prefix[0],
+        config.seen_since_prefix[0]
     )
     source.reply(msg)
 
 
+def show_stats(source: CommandSource):
+    if not stats.enabled:
+        source.reply(tr('text.stats_disabled'))
+        return
+    data = stats.serialize()
+    ret = [tr('fmt.stats', since=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['since'])))]
+    for name, value in data['counters'].items():
+        ret.append(f'§7{name}§r: §6{value}§r')
+    for name, h in data['histograms'].items():
+        ret.append(tr(
+            'fmt.stats_latency', name=name, count=h['count'], mean=h['mean'] * 1000, p50=h['p50'] * 1000,
+            p95=h['p95'] * 1000, max=h['max'] * 1000
+        ))
+    source.reply(RTextBase.join('\n', ret))
+
+
+def reset_stats(source: CommandSource):
+    stats.reset()
+    source.reply(tr('text.stats_reset'))
+
+
+def export_data(source: CommandSource, fmt: str = EXPORT_FORMATS[0]):
+    if fmt not in EXPORT_FORMATS:
+        raise IllegalArgument(f'Illegal argument: {fmt}', 1)
+    run_export(source, fmt)
+
+
+@new_thread(psi.get_self_metadata().name + '_Export')
+def run_export(source: CommandSource, fmt: str):
+    path = os.path.join(EXPORT_FOLDER, time.strftime('seen-%Y%m%d-%H%M%S') + f'.{fmt}')
+    try:
+        count = export_file(storage.rows(), fmt, path)
+    except OSError as exc:
+        source.reply(tr('error.export_failed', str(exc)).set_color(RColor.red))
+        return
+    source.reply(tr('text.exported', count=count, path=path))
+
+
+@new_thread(psi.get_self_metadata().name + '_Backfill')
+def backfill(source: CommandSource):
+    source.reply(tr('text.backfill_started', world=world_folder()))
+    try:
+        last_seen, scanned = collect_last_seen()
+        added = storage.backfill(last_seen).result()
+    except CancelledError:
+        source.reply(tr('error.backfill_failed', 'plugin unloaded').set_color(RColor.red))
+        return
+    except Exception as exc:
+        logger.exception('Failed to backfill players')
+        source.reply(tr('error.backfill_failed', str(exc)).set_color(RColor.red))
+        return
+    source.reply(tr('text.backfilled', count=len(added), players=scanned))
+
+
 # Text layout
-def top(top_players: List[PlayerSeen], prefix: Union[RTextBase, str]):
-    ret, num = [prefix], 1
+@stats.timed('render.top')
+def top(top_players: List[PlayerSeen], prefix: Union[RTextBase, str], start: int = 1):
+    ret, num = [prefix], start
     for p in top_players:
         ret.append(RTextList(f'{num}. ', seen_format(p)))
         num += 1
@@ -127,12 +275,13 @@ def seen_format(player: PlayerSeen):
     return tr('text', player=player).set_translator(seen_fmt_tr)
 
 
+@stats.timed('render.seen_entry')
 def seen_fmt_tr(translation_key: str, player: PlayerSeen, _mcdr_tr_language: Optional[str] = None, language: Optional[str] = None, allow_failure: bool = True):
     if _mcdr_tr_language is None:
         _mcdr_tr_language = language
 
-    def ttr(key: str, *args, **kwargs):
-        return ntr(f'{translation_key}.{key}', *args, language=_mcdr_tr_language, allow_failure=allow_failure, **kwargs)
+    def ttr(key: str):
+        return ctr(f'{translation_key}.{key}', _mcdr_tr_language=_mcdr_tr_language, allow_failure=allow_failure)
     ret = []
     # Bot/Player
     color = '§5' if player.is_bot else '§d'
@@ -152,6 +301,29 @@ def seen_fmt_tr(translation_key: str, player: PlayerSeen, _mcdr_tr_language: Opt
     return ret
 
 
+def time_format(seconds: int):
+    def translator(translation_key: str, *args, _mcdr_tr_language: Optional[str] = None, language: Optional[str] = None,
+                   allow_failure: bool = True, **kwargs):
+        return fmt_time_tr(translation_key, seconds, _mcdr_tr_language=_mcdr_tr_language, language=language,
+                           allow_failure=allow_failure)
+    return tr('fmt.time_seen').set_translator(translator)
+
+
+def playtime_format(name: str, seconds: int):
+    actual_name = name[:-4] if storage.is_bot(name) else name
+    return RTextList(f'§e{actual_name}§r ', time_format(seconds)).h(tr('hover.query_player', actual_name)).c(
+        RAction.run_command, '{} {}'.format(config.seen_prefix[0], actual_name)
+    )
+
+
+def suggest_player(source: CommandSource, context: CommandContext) -> List[str]:
+    # The argument is parsed into the context once it's complete, otherwise it's still in the remaining input
+    prefix = context.get('player')
+    if prefix is None:
+        prefix = context.command_remaining.lstrip('"')
+    return storage.suggest(prefix, limit=SUGGESTION_LIMIT)
+
+
 def seen(source: CommandSource, player: str):
     to_display = []
     player_seen, bot_seen = storage.get(player), storage.get(bot_name(player))
@@ -160,35 +332,104 @@ def seen(source: CommandSource, player: str):
     if bot_seen is not None:
         to_display.append(seen_format(bot_seen))
     if len(to_display) == 0:
-        player_data_not_found(source)
+        player_data_not_found(source, storage.search(player))
+        return
     source.reply(RText.join('\n', to_display))
 
 
 def seen_top(source: CommandSource, exarg: str = None, liver: bool = False):
     # parse arguments
     args = ExtraArguments.parse(exarg, liver)
-    # get list
-    if liver:
-        sorted_list = storage.liver_top(bot=args.bot, _all=args.get_all)
+    # -full is served page by page
+    if args.full:
+        offset, limit = (args.page - 1) * args.size, args.size
+    else:
+        offset, limit = 0, config.seen_top_max
+    # get list, only the visible part is read
+    if args.merge:
+        sorted_list = storage.merged_top(liver, limit=limit, offset=offset)
+        total = storage.merged_size(liver)
     else:
-        sorted_list = storage.seen_top(bot=args.bot, _all=args.get_all)
-    # -merge
-    sorted_list = storage.merge(sorted_list) if args.merge else sorted_list
-    # -full
-    sorted_list = sorted_list if args.full else sorted_list[:config.seen_top_max]
+        get_top = storage.liver_top if liver else storage.seen_top
+        sorted_list = get_top(bot=args.bot, _all=args.get_all, limit=limit, offset=offset)
+        total = storage.top_size(liver, bot=args.bot, _all=args.get_all)
     # get prefix
     prefix = tr(f'fmt.seen_top{"_full" if args.full else ""}', num=config.seen_top_max, arg=args.text)
     if liver:
         prefix = tr('fmt.liver_top', arg=args.text)
 
-    source.reply(top(sorted_list, prefix=prefix))
+    text = top(sorted_list, prefix=prefix, start=offset + 1)
+    if args.full:
+        text = RTextList(text, '\n', page_footer(args, total))
+    source.reply(text)
+
+
+def page_footer(args: ExtraArguments, total: int):
+    pages = max((total + args.size - 1) // args.size, 1)
+    ret = []
+    if args.page > 1:
+        ret.append(tr('text.prev_page').c(RAction.run_command, args.page_command(args.page - 1)).h(
+            tr('hover.goto_page', args.page - 1)))
+    ret.append(tr('fmt.page', page=args.page, pages=pages, total=total))
+    if args.page < pages:
+        ret.append(tr('text.next_page').c(RAction.run_command, args.page_command(args.page + 1)).h(
+            tr('hover.goto_page', args.page + 1)))
+    return RTextBase.join(' ', ret)
 
 
 def liver_top(source: CommandSource, exarg: str = None):
     seen_top(source, exarg, liver=True)
 
 
-def cmd_error(source: CommandSource):
+def playtime_top(source: CommandSource, days: Optional[int] = None):
+    if days is None:
+        ranked = storage.playtime.top(limit=config.seen_top_max)
+        prefix = tr('fmt.playtime_top', num=config.seen_top_max)
+    else:
+        ranked = storage.playtime.window_top(days, limit=config.seen_top_max)
+        prefix = tr('fmt.playtime_top_days', num=config.seen_top_max, days=days)
+    ret = [prefix]
+    for num, (name, seconds) in enumerate(ranked, 1):
+        ret.append(RTextList(f'{num}. ', playtime_format(name, seconds)))
+    source.reply(RTextBase.join('\n', ret))
+
+
+def window_query(source: CommandSource, exarg: str, active: bool):
+    # <window> [-bot|-all]
+    window, _, options = exarg.partition(' ')
+    seconds = parse_duration(window)
+    args = ExtraArguments.parse(options if options != '' else None)
+    if seconds is None or seconds <= 0 or args.merge or args.full:
+        raise IllegalArgument(f'Illegal argument: {exarg}', 1)
+    query = storage.active_since if active else storage.inactive_since
+    players, total = query(now_time() - seconds, bot=args.bot, _all=args.all, limit=config.full_page_size)
+    prefix = tr(f'fmt.seen_{"active" if active else "since"}', count=total, window=time_format(seconds), arg=args.text)
+    text = top(players, prefix=prefix)
+    if total > len(players):
+        text = RTextList(text, '\n', tr('fmt.more', num=total - len(players)))
+    source.reply(text)
+
+
+def seen_active(source: CommandSource, exarg: str):
+    window_query(source, exarg, active=True)
+
+
+def seen_since(source: CommandSource, exarg: str):
+    window_query(source, exarg, active=False)
+
+
+def daily_active(source: CommandSource, days: int = 7):
+    days = min(days, config.playtime_window_days)
+    ret = [tr('fmt.daily_active', days=days)]
+    for day, count in storage.daily_active(days):
+        ret.append(tr('fmt.daily_active_line', date=day.isoformat(), count=count))
+    source.reply(RTextBase.join('\n', ret))
+
+
+def cmd_error(source: CommandSource, error: Optional[CommandError] = None):
+    # Also the callback of nodes run without arguments, they pass the context instead
+    if isinstance(error, CommandError) and error.is_handled():
+        return
     source.reply(
         tr('mcd_seen.error.cmd_error').set_color(color=RColor.red).c(
             RAction.run_command, config.seen_prefix[0]
@@ -198,7 +439,18 @@ def cmd_error(source: CommandSource):
     )
 
 
-def player_data_not_found(source: CommandSource):
+def permission_denied(source: CommandSource):
+    source.reply(tr('mcd_seen.error.permission_denied').set_color(color=RColor.red))
+
+
+def storage_not_ready(source: CommandSource):
+    if storage.failed:
+        source.reply(tr('mcd_seen.error.load_failed').set_color(color=RColor.red))
+    else:
+        source.reply(tr('mcd_seen.text.loading'))
+
+
+def player_data_not_found(source: CommandSource, suggestions: Optional[List[str]] = None):
     source.reply(
         tr('mcd_seen.error.player_data_not_found').set_color(color=RColor.red).c(
             RAction.run_command, config.seen_prefix[0]
@@ -206,6 +458,10 @@ def player_data_not_found(source: CommandSource):
             tr('mcd_seen.hover.show_help')
         )
     )
+    if suggestions:
+        names = [RText(n, RColor.yellow).h(tr('hover.query_player', n)).c(
+            RAction.run_command, '{} {}'.format(config.seen_prefix[0], n)) for n in suggestions]
+        source.reply(RTextList(tr('text.did_you_mean'), RTextBase.join(', ', names)))
 
 
 # FOR DEBUG ONLY
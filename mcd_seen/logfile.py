@@ -0,0 +1,159 @@
+import os
+import sys
+import gzip
+import time
+import shutil
+import logging
+import threading
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from mcdreforged.api.decorator import new_thread
+
+from mcd_seen.config import config, psi
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """
+    Keeps formatted records in memory and appends them to the file from a background thread,
+    once config.log_buffer_lines records are waiting or config.log_flush_interval seconds passed.
+    The file is rotated every day or when it reaches config.log_rotate_size bytes, rotated files are gzipped
+    and removed after config.log_retention_days days. The archives passed in are gzipped but never removed
+    """
+    def __init__(self, path: str, archives: Iterable[str] = (), legacy: Optional[Dict[str, str]] = None):
+        """
+        :param path: The log file
+        :param archives: Plain log files in the same folder to be gzipped along with the rotated ones, and kept
+        :param legacy: Old file path -> new path, moved before the first write
+        """
+        super().__init__()
+        self.path = path
+        self.__archives = list(archives)
+        self.__legacy = dict(legacy or {})
+        self.__buffer = []          # type: List[str]
+        self.__urgent = False
+        self.__cond = threading.Condition()
+        self.__io_lock = threading.Lock()
+        self.__running = False
+        self.__closed = False
+        self.__stream = None
+        self.__size = 0
+        self.__day = None           # type: Optional[date]
+        self.__housekept = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            msg = self.format(record) + '\n'
+        except Exception:
+            self.handleError(record)
+            return
+        with self.__cond:
+            if self.__closed:
+                return
+            self.__buffer.append(msg)
+            # Don't keep warnings and errors waiting
+            if record.levelno >= logging.WARNING:
+                self.__urgent = True
+            if not self.__running:
+                self.__running = True
+                self.__run()
+            self.__cond.notify_all()
+
+    def __should_write(self) -> bool:
+        return self.__urgent or len(self.__buffer) >= config.log_buffer_lines
+
+    @new_thread(psi.get_self_metadata().name + '_LogWriter')
+    def __run(self):
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: len(self.__buffer) > 0 or self.__closed)
+                if self.__closed:
+                    self.__running = False
+                    return
+                self.__cond.wait_for(lambda: self.__should_write() or self.__closed, timeout=config.log_flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.__io_lock:
+            with self.__cond:
+                lines, self.__buffer, self.__urgent = self.__buffer, [], False
+            try:
+                if not self.__housekept:
+                    self.__housekept = True
+                    self.__housekeep()
+                if len(lines) == 0:
+                    return
+                data = ''.join(lines).encode('UTF-8')
+                self.__open()
+                if self.__day != date.today() or (self.__size > 0 and self.__size + len(data) > config.log_rotate_size):
+                    self.__rotate()
+                    self.__open()
+                self.__stream.write(data)
+                self.__stream.flush()
+                self.__size += len(data)
+            except OSError as exc:
+                # Logging about a logging failure would end up here again
+                sys.stderr.write(f'Failed to write {self.path}, dropped {len(lines)} lines: {str(exc)}\n')
+
+    def __open(self):
+        if self.__stream is not None:
+            return
+        self.__stream = open(self.path, 'ab')
+        stat = os.fstat(self.__stream.fileno())
+        self.__size = stat.st_size
+        # A file left from an earlier day is rotated on the first write
+        self.__day = date.fromtimestamp(stat.st_mtime) if self.__size > 0 else date.today()
+
+    def __close_stream(self):
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+
+    def __rotate(self):
+        self.__close_stream()
+        root, ext = os.path.splitext(self.path)
+        stem, index = f'{root}-{self.__day.isoformat()}', 0
+        target = stem + ext
+        while os.path.exists(target + '.gz'):
+            index += 1
+            target = f'{stem}-{index}{ext}'
+        os.replace(self.path, target)
+        self.__compress(target)
+        self.__prune()
+
+    @staticmethod
+    def __compress(path: str):
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+
+    def __housekeep(self):
+        for old, new in self.__legacy.items():
+            if os.path.isfile(old) and not os.path.exists(new):
+                os.replace(old, new)
+        for path in self.__archives:
+            if os.path.isfile(path) and not os.path.exists(path + '.gz'):
+                self.__compress(path)
+        self.__prune()
+
+    def __prune(self):
+        if config.log_retention_days <= 0:
+            return
+        folder = os.path.dirname(self.path) or '.'
+        expire = time.time() - config.log_retention_days * 86400
+        kept = {os.path.abspath(a + '.gz') for a in self.__archives}
+        for file in os.listdir(folder):
+            path = os.path.join(folder, file)
+            if file.endswith('.gz') and os.path.abspath(path) not in kept and os.path.getmtime(path) < expire:
+                os.remove(path)
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.flush()
+        with self.__io_lock:
+            self.__close_stream()
+        super().close()
@@ -0,0 +1,51 @@
+import re
+
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+JOIN = 'join'
+LIST = 'list'
+
+# event, contains, regex, bot
+DEFAULT_PATTERNS = [
+    # Carpet fake players
+    (JOIN, '[local] logged in with entity id ', r'(?P<name>\w+)\[local\] logged in with entity id \d+ at ', True),
+    # Vanilla, Paper and Spigot, the latter ones put the world name in front of the position
+    (JOIN, '] logged in with entity id ', r'(?P<name>\w+)\[[^\]]*\] logged in with entity id \d+ at ', False)
+]
+# Reply of the list command since 1.13, "name" is all the names separated by ", "
+LIST_PATTERNS = [
+    (LIST, ' players online:', r'There are \d+ of a max(?: of)? \d+ players online:(?P<name>.*)$', False)
+]
+
+
+def split_player_list(names: str) -> List[str]:
+    return [n.strip() for n in names.split(',') if n.strip() != '']
+
+
+class LogEvent(NamedTuple):
+    event: str
+    name: str
+    bot: bool
+
+
+class LineMatcher:
+    """
+    Detect player events from server output, a cheap substring check runs before each precompiled regex
+    """
+    def __init__(self, patterns: Iterable[Tuple[str, str, str, bool]]):
+        """
+        :param patterns: (event, contains, regex, bot) tuples, tried in order.
+        The regex is matched from the start of the line and must have a "name" group
+        """
+        self.__patterns = []     # type: List[Tuple[str, str, re.Pattern, bool]]
+        for event, contains, regex, bot in patterns:
+            self.__patterns.append((event, contains, re.compile(regex), bot))
+
+    def match(self, content: str) -> Optional[LogEvent]:
+        for event, contains, regex, bot in self.__patterns:
+            if contains not in content:
+                continue
+            result = regex.match(content)
+            if result is not None:
+                return LogEvent(event, result.group('name'), bot)
+        return None
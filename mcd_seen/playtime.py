@@ -0,0 +1,304 @@
+import os
+import json
+import heapq
+import threading
+
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from mcd_seen.constants import PLAYTIME_FILE, SESSIONS_FILE
+from mcd_seen.config import config
+from mcd_seen.index import SortedIndex
+from mcd_seen.utils import logger
+from mcd_seen.writer import SaveWorker
+
+
+def split_by_day(start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Split a session at local midnights
+    :return: (day, seconds) of every day the session covers
+    """
+    ret = []
+    while start < end:
+        day = date.fromtimestamp(start)
+        midnight = int(datetime.combine(day + timedelta(days=1), dt_time()).timestamp())
+        stop = min(midnight, end)
+        ret.append((day.toordinal(), stop - start))
+        start = stop
+    return ret
+
+
+class PlaytimeTracker:
+    """
+    Total playtime of every player and the daily aggregates of recent days, fed with completed sessions.
+    Sessions are appended to sessions.log, the aggregates are saved in playtime.json along with the log size
+    they cover, so only the sessions after it are replayed on load.
+    The log starts with its generation, bumped whenever it's rotated. A log older than playtime.json is
+    fully counted in it already
+    """
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__save_lock = threading.Lock()
+        self.__totals = {}          # type: Dict[str, int]
+        # Ranked by total playtime, bots and players apart
+        self.__ranks = {False: SortedIndex(), True: SortedIndex()}
+        # day ordinal -> name -> seconds played in that day
+        self.__daily = {}           # type: Dict[int, Dict[str, int]]
+        self.__log = None
+        self.__log_size = 0
+        self.__generation = 0
+        # Sessions counted since the last save
+        self.__pending = 0
+        self.__writer = SaveWorker(self.save)
+
+    @staticmethod
+    def __is_bot(name: str) -> bool:
+        return name.endswith('@bot')
+
+    def load(self) -> 'PlaytimeTracker':
+        with self.__lock:
+            self.__totals, self.__daily, self.__log_size, self.__generation = {}, {}, 0, 0
+            if os.path.isfile(PLAYTIME_FILE):
+                try:
+                    with open(PLAYTIME_FILE, 'r', encoding='UTF-8') as f:
+                        data = json.load(f)
+                    self.__totals = data.get('totals', {})
+                    self.__daily = {int(d): s for d, s in data.get('daily', {}).items()}
+                    self.__log_size = data.get('log_size', 0)
+                    self.__generation = data.get('generation', 0)
+                except (OSError, ValueError) as exc:
+                    # Everything is still in the session log
+                    logger.warning(f'Failed to read {PLAYTIME_FILE}, rebuilding from {SESSIONS_FILE}: {str(exc)}')
+                    self.__totals, self.__daily, self.__log_size, self.__generation = {}, {}, 0, 0
+            if self.__log_generation() < self.__generation:
+                # Rotation was interrupted right after playtime.json was saved
+                self.__rotate_log()
+            replayed = self.__replay()
+            for bot in (False, True):
+                self.__ranks[bot].rebuild((n, t) for n, t in self.__totals.items() if self.__is_bot(n) == bot)
+            self.__prune()
+        if replayed > 0:
+            logger.debug(f'Replayed {replayed} sessions from {SESSIONS_FILE}')
+            self.__pending = replayed
+        return self
+
+    def handoff(self) -> dict:
+        """
+        Live state for the tracker of the reloaded plugin
+        """
+        with self.__lock:
+            return {
+                'totals': self.__totals, 'daily': self.__daily, 'log_size': self.__log_size,
+                'generation': self.__generation, 'pending': self.__pending,
+                'ranks': {bot: index.state() for bot, index in self.__ranks.items()},
+                'dirty': self.__writer.dirty
+            }
+
+    def adopt(self, state: dict):
+        with self.__lock:
+            self.__totals, self.__daily, self.__log_size = state['totals'], state['daily'], state['log_size']
+            self.__generation, self.__pending = state['generation'], state['pending']
+            for bot, index in self.__ranks.items():
+                index.adopt(state['ranks'][bot])
+        if state['dirty']:
+            self.__writer.mark_dirty()
+
+    @staticmethod
+    def __log_generation() -> int:
+        """
+        Generation in the first line of sessions.log, logs of old versions have none and count as 0
+        """
+        if not os.path.isfile(SESSIONS_FILE):
+            return 0
+        with open(SESSIONS_FILE, 'rb') as f:
+            line = f.readline()
+        try:
+            return int(line[1:]) if line.startswith(b'#') and line.endswith(b'\n') else 0
+        except ValueError:
+            return 0
+
+    def __rotate_log(self):
+        """
+        Move the log aside and start the current generation, the log must be counted in playtime.json already
+        """
+        if self.__log is not None:
+            self.__log.close()
+            self.__log = None
+        if os.path.isfile(SESSIONS_FILE):
+            os.replace(SESSIONS_FILE, SESSIONS_FILE + '.old')
+        self.__open_log()
+
+    def __open_log(self):
+        if self.__log is not None:
+            return
+        self.__log = open(SESSIONS_FILE, 'ab')
+        if self.__log.tell() == 0:
+            header = f'#{self.__generation}\n'.encode('UTF-8')
+            self.__log.write(header)
+            self.__log.flush()
+            self.__log_size = len(header)
+
+    def __replay(self) -> int:
+        if not os.path.isfile(SESSIONS_FILE):
+            self.__log_size = 0
+            return 0
+        with open(SESSIONS_FILE, 'rb') as f:
+            if self.__log_size > os.fstat(f.fileno()).st_size:
+                # The log was replaced, count it all over again
+                logger.warning(f'{SESSIONS_FILE} is shorter than recorded, rebuilding playtime from it')
+                self.__totals, self.__daily, self.__log_size = {}, {}, 0
+            f.seek(self.__log_size)
+            tail = f.read()
+        count, offset = 0, self.__log_size
+        for line in tail.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                # Torn tail from a crash, the next append starts from here
+                with open(SESSIONS_FILE, 'r+b') as f:
+                    f.truncate(offset)
+                break
+            offset += len(line)
+            if line.startswith(b'#'):
+                continue
+            try:
+                name, start, end = line.decode('UTF-8').rstrip('\n').split('\t')
+                self.__apply(name, int(start), int(end))
+                count += 1
+            except ValueError:
+                logger.warning(f'Skipped broken session line: {line!r}')
+        self.__log_size = offset
+        return count
+
+    def __apply(self, name: str, start: int, end: int):
+        self.__totals[name] = self.__totals.get(name, 0) + end - start
+        # Days out of the window are not kept anyway
+        oldest = date.today() - timedelta(days=config.playtime_window_days - 1)
+        start = max(start, int(datetime.combine(oldest, dt_time()).timestamp()))
+        for day, seconds in split_by_day(start, end):
+            bucket = self.__daily.setdefault(day, {})
+            bucket[name] = bucket.get(name, 0) + seconds
+
+    def __prune(self):
+        oldest = date.today().toordinal() - config.playtime_window_days + 1
+        for day in [d for d in self.__daily.keys() if d < oldest]:
+            del self.__daily[day]
+
+    def add_session(self, name: str, start: int, end: int):
+        """
+        Count a completed session
+        :param name: Key of the player in storage, bots end with @bot
+        :param start: Joined timestamp
+        :param end: Left timestamp
+        """
+        if end <= start:
+            return
+        line = f'{name}\t{start}\t{end}\n'.encode('UTF-8')
+        with self.__lock:
+            self.__open_log()
+            self.__log.write(line)
+            self.__log.flush()
+            self.__log_size += len(line)
+            self.__apply(name, start, end)
+            self.__ranks[self.__is_bot(name)].add(name, self.__totals[name])
+            self.__pending += 1
+            pending = self.__pending
+        # The session is safe in the log, rewriting playtime.json only shortens the replay on load
+        if pending >= config.playtime_save_sessions:
+            self.__writer.mark_dirty()
+
+    def total(self, name: str) -> int:
+        with self.__lock:
+            return self.__totals.get(name, 0)
+
+    def top(self, bot: bool = False, limit: Optional[int] = None, offset: int = 0) -> List[Tuple[str, int]]:
+        """
+        Players with the longest total playtime first
+        :return: (name, seconds) list
+        """
+        with self.__lock:
+            return [(n, t) for t, n in self.__ranks[bot].slice(offset, limit, reverse=True)]
+
+    def window_top(self, days: int, bot: bool = False, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Players with the longest playtime in the last days, today included
+        :return: (name, seconds) list
+        """
+        today = date.today().toordinal()
+        window = {}     # type: Dict[str, int]
+        with self.__lock:
+            for day in range(today - days + 1, today + 1):
+                for name, seconds in self.__daily.get(day, {}).items():
+                    if self.__is_bot(name) == bot:
+                        window[name] = window.get(name, 0) + seconds
+        def key(item: Tuple[str, int]):
+            return -item[1], item[0]
+        if limit is None:
+            return sorted(window.items(), key=key)
+        return heapq.nsmallest(limit, window.items(), key=key)
+
+    def daily_active(self, days: int, bot: bool = False, online: Iterable[str] = ()) -> List[Tuple[date, int]]:
+        """
+        Amount of players who played in each of the last days, today first
+        :param online: Players online right now, counted in today
+        """
+        today, ret = date.today(), []
+        with self.__lock:
+            for i in range(days):
+                day = today - timedelta(days=i)
+                names = {n for n in self.__daily.get(day.toordinal(), {}).keys() if self.__is_bot(n) == bot}
+                if i == 0:
+                    names.update(n for n in online if self.__is_bot(n) == bot)
+                ret.append((day, len(names)))
+        return ret
+
+    def size(self, bot: bool = False) -> int:
+        with self.__lock:
+            return len(self.__ranks[bot])
+
+    def save(self):
+        with self.__save_lock:
+            with self.__lock:
+                self.__prune()
+                self.__pending = 0
+                rotate = self.__log_size > config.sessions_log_rotate_size
+                to_save = None if rotate else self.__state()
+            if to_save is not None:
+                self.__write(to_save)
+                return
+            # Rotating blocks new sessions until the log is replaced, the log must not get ahead of playtime.json
+            with self.__lock:
+                self.__generation += 1
+                self.__log_size = 0
+                self.__write(self.__state())
+                self.__rotate_log()
+            logger.debug(f'Rotated {SESSIONS_FILE}, now generation {self.__generation}')
+
+    def __state(self) -> dict:
+        return {
+            'generation': self.__generation,
+            'log_size': self.__log_size,
+            'totals': dict(self.__totals),
+            'daily': {str(d): dict(s) for d, s in self.__daily.items()}
+        }
+
+    @staticmethod
+    def __write(to_save: dict):
+        temp_file = PLAYTIME_FILE + '.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            json.dump(to_save, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, PLAYTIME_FILE)
+
+    def flush(self):
+        self.__writer.flush()
+        if self.__pending > 0:
+            self.save()
+
+    def close(self):
+        self.__writer.stop()
+        if self.__pending > 0:
+            self.save()
+        with self.__lock:
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
@@ -0,0 +1,69 @@
+import os
+import sys
+import mmap
+import struct
+
+from array import array
+from typing import List, Tuple
+
+# Names, joined and left of every player, in the same order
+Columns = Tuple[List[str], array, array]
+
+# Layout: header, joined column, left column, then all the names in UTF-8 separated by NUL
+# Columns are little-endian int64 so they can be copied into array('q') as a whole
+MAGIC = b'SEEN'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+
+
+def empty_columns() -> Columns:
+    return [], array('q'), array('q')
+
+
+def write_binary_snapshot(path: str, columns: Columns):
+    names, joined, left = columns
+    if sys.byteorder != 'little':
+        joined, left = array('q', joined), array('q', left)
+        joined.byteswap()
+        left.byteswap()
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(names)))
+        f.write(joined.tobytes())
+        f.write(left.tobytes())
+        f.write('\0'.join(names).encode('UTF-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+
+def read_binary_snapshot(path: str) -> Columns:
+    """
+    Columns are copied out of the mapping and all the names decoded at once. Decoding lazily gains nothing here:
+    loading indexes every name and timestamp right away, and compact records update the columns in place
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError(f'Truncated seen snapshot {path}')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, count = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'Unsupported seen snapshot {path}')
+            view = memoryview(mm)
+            try:
+                offset = HEADER.size
+                joined, left = array('q'), array('q')
+                joined.frombytes(view[offset:offset + count * 8])
+                offset += count * 8
+                left.frombytes(view[offset:offset + count * 8])
+                offset += count * 8
+                blob = bytes(view[offset:])
+            finally:
+                view.release()
+    if sys.byteorder != 'little':
+        joined.byteswap()
+        left.byteswap()
+    names = blob.decode('UTF-8').split('\0') if count > 0 else []
+    if len(names) != count or len(joined) != count or len(left) != count:
+        raise ValueError(f'Truncated seen snapshot {path}')
+    return names, joined, left
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import functools
+import threading
+
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from mcd_seen.config import config
+
+Func = TypeVar('Func', bound=Callable[..., Any])
+# Bucket i counts durations below 2 ** i microseconds, the last one takes everything longer
+BUCKETS = 32
+
+
+class Histogram:
+    """
+    Latency histogram with power of 2 microsecond buckets
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound in seconds of the bucket the p-th percentile falls into
+        """
+        target, seen = self.count * p / 100, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n > 0 and seen >= target:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def serialize(self) -> dict:
+        return {
+            'count': self.count, 'total': self.total, 'mean': self.mean, 'max': self.max,
+            'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+            'buckets': list(self.buckets)
+        }
+
+
+class Stats:
+    """
+    Counters and latency histograms of the plugin, nothing is collected unless config.stats is on.
+    The switch is read once on plugin load, timed() leaves functions untouched when it's off
+    """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.since = time.time()
+        self.__lock = threading.Lock()
+        self.__counters = {}        # type: Dict[str, int]
+        self.__histograms = {}      # type: Dict[str, Histogram]
+
+    def count(self, name: str, amount: int = 1):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, name: str) -> Callable[[Func], Func]:
+        """
+        Decorator recording the duration of every call into histogram name
+        """
+        def decorator(func: Func) -> Func:
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.__lock:
+            self.since = time.time()
+            self.__counters = {}
+            self.__histograms = {}
+
+    def serialize(self) -> dict:
+        with self.__lock:
+            return {
+                'since': int(self.since),
+                'counters': dict(sorted(self.__counters.items())),
+                'histograms': {n: h.serialize() for n, h in sorted(self.__histograms.items())}
+            }
+
+    def dump(self, path: str, indent: Optional[int] = 4):
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w', encoding='UTF-8') as f:
+            json.dump(self.serialize(), f, indent=indent)
+        os.replace(temp_file, path)
+
+
+stats = Stats(config.stats)
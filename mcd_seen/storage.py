@@ -1,21 +1,37 @@
-import os
-import json
-import time
-import shutil
+import threading
 
-from typing import Dict, List, Iterable, Optional
+from array import array
+from concurrent.futures import Future
+from datetime import date
+from difflib import SequenceMatcher
+from itertools import chain, islice
+from typing import Any, Callable, Dict, List, Iterable, Iterator, Optional, Tuple
 
-from mcdreforged.api.decorator import new_thread
 from mcdreforged.api.utils import Serializable
 
-from mcd_seen.constants import SEENS_FILE, SEENS_PATH_OLD
-from mcd_seen.utils import now_time, log_seen, logger, bot_name, is_bot, psi
+from mcd_seen.backend import StorageBackend, create_backend
+from mcd_seen.compact import SeenMixin, CompactRecords
+from mcd_seen.index import LeaderBoards, PrefixIndex
+from mcd_seen.playtime import PlaytimeTracker
+from mcd_seen.stats import stats
+from mcd_seen.utils import log_seen, logger, bot_name
 from mcd_seen.config import config
+from mcd_seen.events import EventQueue, Ticker
+from mcd_seen.writer import SaveWorker
 
 bot_list = []
-
-
-class PlayerSeen(Serializable):
+# Players whose bot joined while they were online. Carpet logs the bot in before the player leaves when shadowing,
+# so the next leave of such a name is the player's
+shadow_list = []
+# Prefix matches ranked for "did you mean"
+SEARCH_CANDIDATES = 100
+# Records copied at a time by rows()
+ROWS_CHUNK = 1000
+# Bumped whenever the layout of SeenStorage.handoff() changes
+HANDOFF_VERSION = 3
+
+
+class PlayerSeen(Serializable, SeenMixin):
     name: str
     joined: int = 0
     left: int = 0
@@ -24,170 +40,651 @@ class PlayerSeen(Serializable):
         super().__init__(**kwargs)
         self.name = name
 
-    @property
-    def online(self):
-        return self.joined > self.left
-
-    def join(self):
-        self.joined = now_time()
-
-    def leave(self):
-        self.left = now_time()
-        if self.joined == 0:
-            self.joined = now_time() - 1
-
-    @property
-    def actual_name(self):
-        return self.name[:-4] if self.is_bot else self.name
-
-    @property
-    def is_bot(self):
-        return self.name.endswith('@bot')
-
-    @property
-    def target(self) -> int:
-        return self.joined if self.online else self.left
+    @classmethod
+    def of(cls, name: str, joined: int, left: int) -> 'PlayerSeen':
+        """
+        Bulk loading constructor skipping Serializable field processing
+        """
+        ret = cls.__new__(cls)
+        ret.name, ret.joined, ret.left = name, joined, left
+        return ret
 
     def serialize(self) -> dict:
         ret = super().serialize()
         ret.pop('name')
         return ret
 
-    @property
-    def is_empty(self):
-        return self.joined == self.left == 0
+
+def merge_key(name: str, joined: int, left: int) -> Tuple[bool, int]:
+    """
+    The record with the greater key represents a player and the bot of the same name in merged ranks
+    """
+    is_player, target = not name.endswith('@bot'), joined if joined > left else left
+    return (is_player, target) if config.player_prior_in_merge else (target, is_player)
 
 
 class SeenStorage:
     def __init__(self):
-        self.data = {}      # type: Dict[str, PlayerSeen]
+        self.data = self.__new_records()      # type: Dict[str, PlayerSeen]
+        # lower-cased name -> key in self.data, the latest inserted name wins like the old lower_data did
+        self.__lower_index = {}     # type: Dict[str, str]
+        # Actual names of players and bots
+        self.__names = PrefixIndex()
+        self.__boards = LeaderBoards()
+        # Keyed by actual names, a player and its bot are merged into the record named in __merged_names
+        self.__merged = LeaderBoards()
+        self.__merged_names = {}    # type: Dict[str, str]
+        # Key -> the other server sharing the store that wrote its record, reconcile leaves them alone
+        self.__foreign = {}         # type: Dict[str, str]
+        # Key -> (joined, left, server) of an online record from another server while the player is online here,
+        # taken once the player goes offline here since the player may have moved to that server
+        self.__pending_foreign = {}     # type: Dict[str, Tuple[int, int, str]]
+        self.__lock = threading.RLock()
+        self.__save_lock = threading.Lock()
+        # Created by the first load or adopt on the event thread, opening a database may migrate it
+        self.backend = None         # type: Optional[StorageBackend]
+        self.playtime = PlaytimeTracker()
+        self.__writer = SaveWorker(self.save)
+        self.__events = EventQueue()
+        self.__sync_ticker = None   # type: Optional[Ticker]
+        # Set once the data is loaded or adopted, nothing is read or written before it
+        self.__ready = threading.Event()
+        self.__failed = False
+
+    @property
+    def ready(self) -> bool:
+        return self.__ready.is_set()
+
+    @property
+    def failed(self) -> bool:
+        """
+        If the background load failed, the storage stays unready until the plugin is reloaded
+        """
+        return self.__failed
+
+    @property
+    def lock(self) -> threading.RLock:
+        """
+        Held while records change, hold it to read several records consistently
+        """
+        return self.__lock
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self.__ready.wait(timeout)
+
+    def load_later(self, state: Optional[dict] = None):
+        """
+        Load on the event thread instead of the caller's, events submitted meanwhile are queued behind it
+        and applied once it's done
+        :param state: Handed off by the previous plugin instance, adopted instead of loading from disk if possible
+        """
+        self.__events.submit(self.__initialize, state)
+
+    @stats.timed('storage.initialize')
+    def __initialize(self, state: Optional[dict]):
+        try:
+            if state is None or not self.adopt(state):
+                self.load()
+        except Exception:
+            self.__failed = True
+            logger.exception('Failed to load seen data, events are dropped until the plugin is reloaded')
+            return
+        if self.backend.shared:
+            self.__sync_ticker = Ticker(config.shared_sync_interval, self.sync)
+            self.__sync_ticker.start()
+
+    def __submit(self, func: Callable[..., Any], *args) -> Future:
+        return self.__events.submit(self.__when_ready, func, *args)
+
+    def __when_ready(self, func: Callable[..., Any], *args):
+        # Queued behind the load, so it's only unready here when loading failed
+        if self.__ready.is_set():
+            return func(*args)
 
-    @new_thread(psi.get_self_metadata().name + '_PlayerJoin')
     def player_joined(self, name: str, save=True):
-        self[name].join()
+        self.__submit(self.__player_joined, name, save)
+
+    def player_left(self, name: str, save=True):
+        self.__submit(self.__player_left, name, save)
+
+    def debug_remove(self, players: Iterable[str]):
+        self.__submit(self.__debug_remove, list(players))
+
+    def reconcile(self, player_list: Iterable[str], count_playtime: bool = False):
+        """
+        Set players to online or offline to match the players actually online, all changes are persisted at once
+        :param player_list: Names of all the players online, bots included
+        :param count_playtime: Count the sessions ended here into playtime, only when they really end now.
+        After a crash or while the plugin was unloaded they ended at some unknown time before
+        """
+        self.__submit(self.__reconcile, list(player_list), count_playtime)
+
+    def backfill(self, last_seen: Dict[str, int]) -> Future:
+        """
+        Add offline records of players unknown to the storage, all persisted at once
+        :param last_seen: Name -> timestamp the player was last seen, taken as the left time
+        :return: Resolved with the names added
+        """
+        return self.__submit(self.__backfill, dict(last_seen))
+
+    def sync(self):
+        """
+        Pull the changes other servers made to the shared store, applied in order with the local events
+        """
+        self.__submit(self.__sync)
+
+    def wait_until_drained(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until all the submitted events are applied
+        :param timeout: Give up after this many seconds
+        :return: If all the events are applied
+        """
+        return self.__events.wait_until_drained(timeout)
+
+    @stats.timed('event.join')
+    def __player_joined(self, name: str, save: bool):
+        self.update(self[name], PlayerSeen.join)
         log_seen(f'Player {name} joined the game')
         if self.is_bot(name):
-            time.sleep(config.bot_list_delay)
+            player = self.data.get(name[:-4])
+            if player is not None and player.online:
+                shadow_list.append(name[:-4])
             bot_list.append(name)
         if save:
-            self.save()
+            self.record(self[name])
 
-    @new_thread(psi.get_self_metadata().name + '_PlayerLeft')
-    def player_left(self, name: str, save=True):
-        if bot_name(name) in bot_list:
+    @stats.timed('event.leave')
+    def __player_left(self, name: str, save: bool):
+        if name in shadow_list:
+            shadow_list.remove(name)
+        elif bot_name(name) in bot_list:
             name = bot_name(name)
             bot_list.remove(name)
-        self[name].leave()
+        self.update(self[name], PlayerSeen.leave)
         log_seen(f'Player {name} left the game')
         if save:
-            self.save()
+            self.record(self[name])
+        with self.__lock:
+            self.__resume_foreign(name)
 
-    @new_thread(psi.get_self_metadata().name + '_Debug')
-    def debug_remove(self, players: Iterable[str]):
+    def __debug_remove(self, players: List[str]):
         removed = []
-        for p in players:
-            result = self.data.pop(p, None)
-            if result is not None:
-                removed.append(p)
+        with self.__lock:
+            for p in players:
+                if self.__drop(p):
+                    if self.backend.remove(p):
+                        self.__writer.mark_dirty()
+                    removed.append(p)
         logger.debug(f"Removed {len(removed)} players' data: {', '.join(removed)}")
 
+    def __drop(self, name: str) -> bool:
+        with self.__lock:
+            if self.data.pop(name, None) is None:
+                return False
+            self.__unindex_name(name)
+            self.__names.discard(name[:-4] if self.is_bot(name) else name)
+            self.__boards.discard(name)
+            self.__refresh_merged(name[:-4] if self.is_bot(name) else name)
+            self.__foreign.pop(name, None)
+            self.__pending_foreign.pop(name, None)
+            return True
+
+    @stats.timed('storage.backfill')
+    def __backfill(self, last_seen: Dict[str, int]) -> List[str]:
+        with self.__lock:
+            added = [n for n in last_seen.keys() if self.get(n) is None]
+            if len(added) == 0:
+                return added
+            for name in added:
+                self.__put(name, 0, last_seen[name])
+            # Rebuilt in one go like load() does, inserting into the indexes one by one is quadratic
+            self.__rebuild_index()
+            self.__boards.rebuild(
+                (p, j > l, p.endswith('@bot'), j if j > l else l) for p, j, l in self.__rows()
+            )
+            self.__rebuild_merged()
+        logger.info(f'Backfilled {len(added)} players')
+        if self.backend.record_many((n, 0, last_seen[n]) for n in added):
+            self.save()
+        return added
+
+    @stats.timed('storage.sync')
+    def __sync(self):
+        applied = 0
+        records = self.backend.sync()
+        with self.__lock:
+            for name, joined, left, server in records:
+                if self.__apply_foreign(name, joined, left, server):
+                    applied += 1
+        if applied > 0:
+            logger.debug(f'Synced {applied} of {len(records)} changes from the other servers')
+
+    def __apply_foreign(self, name: str, joined: int, left: int, server: str) -> bool:
+        """
+        Take a record written by another server, online records win over offline ones and later ones win
+        among the same status. A player online here is left to the local events
+        """
+        if joined == left == 0:
+            return self.__drop(name)
+        seen = self.data.get(name)
+        if seen is not None and self.__foreign.get(name) != server:
+            online = joined > left
+            if seen.online and (not online or name not in self.__foreign):
+                if online:
+                    self.__pending_foreign[name] = (joined, left, server)
+                elif self.__pending_foreign.get(name, (0, 0, None))[2] == server:
+                    del self.__pending_foreign[name]
+                return False
+            if not seen.online and not online and left < seen.target:
+                return False
+        if seen is None:
+            self[name] = PlayerSeen.of(name, joined, left)
+        else:
+            self.__boards.discard(name)
+            seen.joined, seen.left = joined, left
+            self.__boards.add(name, seen.online, seen.is_bot, seen.target)
+            self.__refresh_merged(seen.actual_name)
+        self.__foreign[name] = server
+        return True
+
+    def __resume_foreign(self, name: str):
+        """
+        Take the pending record of another server once the player is offline here, after the local change is persisted
+        """
+        seen = self.data.get(name)
+        if seen is None or seen.online or name not in self.__pending_foreign:
+            return
+        self.__apply_foreign(name, *self.__pending_foreign.pop(name))
+
     @staticmethod
     def is_bot(name: str) -> bool:
         return name.endswith('@bot')
 
+    @stats.timed('storage.record')
+    def record(self, seen: PlayerSeen):
+        """
+        Persist the change of a single player through the backend
+        Snapshot writes are left to the background writer
+        :param seen: The changed player
+        """
+        if self.backend.record(seen.name, seen.joined, seen.left):
+            self.__writer.mark_dirty()
+
+    def flush(self):
+        """
+        Apply queued events, write pending changes and fold the backend backlog into the snapshot right now
+        """
+        self.__events.wait_until_drained()
+        self.__writer.flush()
+        if self.__ready.is_set() and self.backend.has_backlog:
+            self.save()
+        self.playtime.flush()
+
+    def close(self):
+        if self.__sync_ticker is not None:
+            self.__sync_ticker.stop()
+        self.__events.stop()
+        self.__writer.stop()
+        self.flush()
+        if self.__ready.is_set() and self.backend.needs_export:
+            with self.__lock:
+                to_export = self.__records()
+            self.backend.export(to_export)
+        if self.backend is not None:
+            self.backend.close()
+        self.playtime.close()
+
+    @stats.timed('storage.save')
     def save(self):
-        to_save = {}
-        for p, s in self.data.items():
-            if not s.is_empty:
-                to_save[p] = s.serialize()
-        with open(SEENS_FILE, 'w', encoding='UTF-8') as f:
-            json.dump(to_save, f, ensure_ascii=False, indent=4)
+        if not self.__ready.is_set():
+            # Would overwrite the data on disk with an empty or partial one
+            return
+        with self.__save_lock:
+            with self.__lock:
+                to_save = self.__records()
+                self.backend.prepare_save()
+            self.backend.save(to_save)
+
+    def rows(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Iterate all the records as (name, joined, left), copied ROWS_CHUNK at a time with the storage locked,
+        so all of them are never held at once. Records added meanwhile may be missed
+        """
+        with self.__lock:
+            data = self.data
+            # Records keep their slot in the columns, a dict is walked through a copy of its keys instead
+            keys = None if isinstance(data, CompactRecords) else list(data)
+            end = len(data.names) if keys is None else len(keys)
+        for start in range(0, end, ROWS_CHUNK):
+            with self.__lock:
+                if keys is None:
+                    chunk = list(data.rows(start, start + ROWS_CHUNK))
+                else:
+                    names = keys[start:start + ROWS_CHUNK]
+                    chunk = [(p, s.joined, s.left) for p, s in zip(names, map(data.get, names)) if s is not None]
+            yield from (r for r in chunk if not r[1] == r[2] == 0)
+
+    def __records(self) -> List[Tuple[str, int, int]]:
+        return [r for r in self.__rows() if not r[1] == r[2] == 0]
+
+    def __rows(self) -> Iterator[Tuple[str, int, int]]:
+        if isinstance(self.data, CompactRecords):
+            return self.data.rows()
+        return ((p, s.joined, s.left) for p, s in self.data.items())
 
+    @staticmethod
+    def __new_records() -> Dict[str, PlayerSeen]:
+        return CompactRecords() if config.compact_records else {}
+
+    def __put(self, name: str, joined: int, left: int):
+        if isinstance(self.data, CompactRecords):
+            self.data.put(name, joined, left)
+        else:
+            self.data[name] = PlayerSeen.of(name, joined, left)
+
+    @stats.timed('storage.load')
     def load(self):
-        self.data = {}
-        need_convert = False
-        if not os.path.isfile(SEENS_FILE):
-            for f in SEENS_PATH_OLD:
-                if os.path.isfile(f):
-                    shutil.move(f, SEENS_FILE)
-                    need_convert = True
-                    break
-            if not need_convert:
-                self.save()
-        with open(SEENS_FILE, 'r', encoding='UTF-8') as f:
-            to_load = json.load(f)
-        for p, s in to_load.copy().items():
-            to_des = s.copy()
-            pl = p
-            if need_convert and is_bot(p):
-                pl = bot_name(p)
-            to_des['name'] = pl
-            self.data[pl] = PlayerSeen.deserialize(to_des)
+        self.__open_backend()
+        self.data = self.__new_records()
+        names, joined, left = self.backend.load_snapshot()
+        if isinstance(self.data, CompactRecords):
+            self.data.extend(names, joined, left)
+        else:
+            for name, j, l in zip(names, joined, left):
+                self.data[name] = PlayerSeen.of(name, j, l)
+        for name, joined, left in self.backend.load_tail():
+            if joined == left == 0:
+                self.data.pop(name, None)
+            else:
+                self.__put(name, joined, left)
+        self.__rebuild_index()
+        self.__boards.rebuild(
+            (p, j > l, p.endswith('@bot'), j if j > l else l) for p, j, l in self.__rows()
+        )
+        self.__rebuild_merged()
+        self.__foreign = self.backend.foreign_names()
+        self.__pending_foreign = {}
+        self.playtime.load()
+        self.__ready.set()
         return self
 
-    def seen_top(self, bot=False, _all=False):
-        to_sort = []        # type: List[PlayerSeen]
-        for p, s in self.data.items():
-            if not s.online:
-                if self.should_list(s, bot, _all):
-                    to_sort.append(s)
-        return sorted(to_sort, key=lambda x: x.target)
-
-    def liver_top(self, bot=False, _all=False):
-        to_sort = []        # type: List[PlayerSeen]
-        for p, s in self.data.items():
-            if s.online:
-                if self.should_list(s, bot, _all):
-                    to_sort.append(s)
-        return sorted(to_sort, key=lambda y: y.target, reverse=True)
+    def __open_backend(self) -> StorageBackend:
+        if self.backend is None:
+            self.backend = create_backend()
+        return self.backend
+
+    def handoff(self) -> Optional[dict]:
+        """
+        Live state for the storage of the reloaded plugin, classes differ between module instances,
+        so it's made of builtins and arrays only
+        :return: None if there's nothing loaded to hand off
+        """
+        if not self.__ready.is_set():
+            return None
+        with self.__lock:
+            if isinstance(self.data, CompactRecords):
+                records = self.data.state()
+            else:
+                records = tuple(map(list, zip(*self.__rows()))) or ([], [], [])
+            return {
+                'version': HANDOFF_VERSION,
+                'storage_mode': config.storage_mode,
+                'snapshot_format': config.snapshot_format,
+                'player_prior_in_merge': config.player_prior_in_merge,
+                'compact': isinstance(self.data, CompactRecords),
+                'records': records,
+                'lower_index': self.__lower_index,
+                'names': self.__names.state(),
+                'boards': self.__boards.state(),
+                'merged': self.__merged.state(),
+                'merged_names': self.__merged_names,
+                'foreign': self.__foreign,
+                'pending_foreign': self.__pending_foreign,
+                'backend': self.backend.handoff(),
+                'dirty': self.__writer.dirty,
+                'playtime': self.playtime.handoff()
+            }
+
+    def adopt(self, state: dict) -> bool:
+        """
+        Take over the state handed off by the storage of the previous plugin instance instead of loading from disk
+        :return: If the state is taken, it's refused when it comes from a different version or storage settings
+        """
+        if state.get('version') != HANDOFF_VERSION or state.get('storage_mode') != config.storage_mode or \
+                state.get('snapshot_format') != config.snapshot_format or \
+                not self.__open_backend().adopt(state['backend']):
+            return False
+        with self.__lock:
+            self.data = self.__new_records()
+            if state['compact']:
+                names, joined, left = state['records'][:3]
+                if isinstance(self.data, CompactRecords):
+                    self.data.adopt(state['records'])
+                else:
+                    for name, j, l in zip(names, joined, left):
+                        if name is not None:
+                            self.data[name] = PlayerSeen.of(name, j, l)
+            else:
+                names, joined, left = state['records']
+                if isinstance(self.data, CompactRecords):
+                    self.data.extend(names, array('q', joined), array('q', left))
+                else:
+                    for name, j, l in zip(names, joined, left):
+                        self.data[name] = PlayerSeen.of(name, j, l)
+            self.__lower_index = state['lower_index']
+            self.__names.adopt(state['names'])
+            self.__boards.adopt(state['boards'])
+            if state['player_prior_in_merge'] == config.player_prior_in_merge:
+                self.__merged.adopt(state['merged'])
+                self.__merged_names = state['merged_names']
+            else:
+                # The option is changed by a reload, rank the merged entries with the new rule
+                self.__rebuild_merged()
+            self.__foreign = state['foreign']
+            self.__pending_foreign = state['pending_foreign']
+            self.playtime.adopt(state['playtime'])
+        if state['dirty']:
+            self.__writer.mark_dirty()
+        self.__ready.set()
+        logger.debug(f'Took over {len(self.data)} players from the previous plugin instance')
+        return True
+
+    def __rebuild_merged(self):
+        chosen = {}     # type: Dict[str, Tuple[str, int, int]]
+        for row in self.__rows():
+            name = row[0]
+            actual = name[:-4] if name.endswith('@bot') else name
+            current = chosen.get(actual)
+            if current is None or merge_key(*row) > merge_key(*current):
+                chosen[actual] = row
+        self.__merged_names = {a: row[0] for a, row in chosen.items()}
+        self.__merged.rebuild((a, j > l, False, j if j > l else l) for a, (_, j, l) in chosen.items())
+
+    def __refresh_merged(self, actual: str):
+        candidates = [s for s in (self.data.get(actual), self.data.get(bot_name(actual))) if s is not None]
+        if len(candidates) == 0:
+            self.__merged.discard(actual)
+            self.__merged_names.pop(actual, None)
+            return
+        chosen = max(candidates, key=lambda s: merge_key(s.name, s.joined, s.left))
+        self.__merged_names[actual] = chosen.name
+        self.__merged.add(actual, chosen.online, False, chosen.target)
+
+    @stats.timed('storage.update')
+    def update(self, seen: PlayerSeen, transition: Callable[[PlayerSeen], Any], count_playtime: bool = True):
+        """
+        Apply a state transition on a stored player and keep the leaderboards in order,
+        a session ended by the transition is counted into playtime
+        :param seen: The stored player
+        :param transition: The transition, PlayerSeen.join or PlayerSeen.leave for example
+        :param count_playtime: If a session ended by the transition is counted
+        """
+        with self.__lock:
+            was_online, joined = seen.online, seen.joined
+            self.__boards.discard(seen.name)
+            transition(seen)
+            self.__foreign.pop(seen.name, None)
+            self.__boards.add(seen.name, seen.online, seen.is_bot, seen.target)
+            self.__refresh_merged(seen.actual_name)
+            if count_playtime and was_online and not seen.online:
+                self.playtime.add_session(seen.name, joined, seen.left)
+
+    def seen_top(self, bot=False, _all=False, limit: Optional[int] = None, offset: int = 0) -> List[PlayerSeen]:
+        with self.__lock:
+            return [self.data[p] for p in self.__boards.top(False, bot, _all, limit, offset)]
+
+    def liver_top(self, bot=False, _all=False, limit: Optional[int] = None, offset: int = 0) -> List[PlayerSeen]:
+        with self.__lock:
+            return [self.data[p] for p in self.__boards.top(True, bot, _all, limit, offset)]
+
+    def top_size(self, online: bool, bot=False, _all=False) -> int:
+        with self.__lock:
+            return self.__boards.count(online, bot, _all)
+
+    def merged_top(self, online: bool, limit: Optional[int] = None, offset: int = 0) -> List[PlayerSeen]:
+        """
+        Ranks with a player and its bot merged into one entry, ordered like seen_top or liver_top
+        """
+        with self.__lock:
+            return [self.data[self.__merged_names[a]] for a in self.__merged.top(online, limit=limit, offset=offset)]
+
+    def merged_size(self, online: bool) -> int:
+        with self.__lock:
+            return self.__merged.count(online)
+
+    def active_since(self, since: int, bot=False, _all=False, limit: Optional[int] = None) -> Tuple[List[PlayerSeen], int]:
+        """
+        Players online or left at or after since, the online ones first, then the latest left first
+        :return: The players up to limit, and the amount of them all
+        """
+        with self.__lock:
+            names = chain(
+                self.__boards.top(True, bot, _all, limit),
+                self.__boards.between(False, bot, _all, low=since, limit=limit, reverse=True)
+            )
+            players = [self.data[p] for p in islice(names, limit)]
+            return players, self.__boards.count(True, bot, _all) + self.__boards.count_between(False, bot, _all, low=since)
+
+    def inactive_since(self, since: int, bot=False, _all=False, limit: Optional[int] = None) -> Tuple[List[PlayerSeen], int]:
+        """
+        Players offline since before since, the oldest left first
+        :return: The players up to limit, and the amount of them all
+        """
+        with self.__lock:
+            players = [self.data[p] for p in self.__boards.between(False, bot, _all, high=since, limit=limit)]
+            return players, self.__boards.count_between(False, bot, _all, high=since)
+
+    def daily_active(self, days: int, bot=False) -> List[Tuple[date, int]]:
+        """
+        Amount of players who played in each of the last days, today first
+        """
+        with self.__lock:
+            online = list(self.__boards.top(True, bot))
+        return self.playtime.daily_active(days, bot, online)
 
     @property
     def lower_data(self) -> Dict[str, PlayerSeen]:
         ret = {}
-        for p, s in self.data.items():
-            ret[p.lower()] = s
+        for lower, p in self.__lower_index.items():
+            ret[lower] = self.data[p]
         return ret
 
+    def __rebuild_index(self):
+        self.__lower_index = {}
+        for p in self.data.keys():
+            self.__lower_index[p.lower()] = p
+        self.__names.rebuild(p[:-4] if self.is_bot(p) else p for p in self.data.keys())
+
+    def __unindex_name(self, name: str):
+        lower = name.lower()
+        if self.__lower_index.get(lower) != name:
+            return
+        # Fall back to the latest remaining name in the same case-folded group
+        self.__lower_index.pop(lower)
+        for p in self.data.keys():
+            if p.lower() == lower:
+                self.__lower_index[lower] = p
+
     @staticmethod
     def should_list(target: PlayerSeen, bot: bool, _all: bool):
         return bool(bot and target.is_bot) or bool(not bot and not target.is_bot) or _all
 
-    @staticmethod
-    def merge(ite: Iterable[PlayerSeen]):
-        ret = {}
-        for i in ite:
-            if i.actual_name not in ret:
-                ret[i.actual_name] = i
-            else:
-                if config.player_prior_in_merge:
-                    ret[i.actual_name] = ret[i.actual_name] if i.is_bot else i
-                else:
-                    ret[i.actual_name] = ret[i.actual_name] if ret[i.actual_name] > i else i
-        return sorted(list(ret.copy().values()), key=lambda z: z.target)
-
     def get(self, name: str) -> Optional[PlayerSeen]:
-        return self.lower_data.get(name.lower())
-
-    @new_thread(psi.get_self_metadata().id + '_DataCorrect')
-    def correct(self, player_list: List[str]):
-        for s in self.data.values():
-            if s.online and s.actual_name not in player_list:
-                logger.info(f'Corrected player {s.name} status to offline')
-                s.leave()
-
-        for p in player_list:
-            s = self[p]
-            if not s.online:
-                logger.info(f'Corrected player {s.name} status to online')
-                s.join()
+        key = self.__lower_index.get(name.lower())
+        return None if key is None else self.data[key]
+
+    def suggest(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Actual names starting with prefix case-insensitively, in alphabetical order
+        """
+        with self.__lock:
+            return self.__names.prefixed(prefix, limit)
+
+    def search(self, name: str, limit: int = 5) -> List[str]:
+        """
+        Actual names similar to name, taken from the names sharing the longest prefix with it
+        """
+        candidates = []
+        with self.__lock:
+            for length in range(len(name), 0, -1):
+                candidates = self.__names.prefixed(name[:length], SEARCH_CANDIDATES)
+                if len(candidates) > 0:
+                    break
+        lower = name.lower()
+        candidates.sort(key=lambda c: (-SequenceMatcher(None, lower, c.lower()).ratio(), c.lower()))
+        return candidates[:limit]
+
+    @stats.timed('event.reconcile')
+    def __reconcile(self, player_list: List[str], count_playtime: bool):
+        listed = {p.lower(): p for p in player_list}
+        changed = []    # type: List[str]
+        with self.__lock:
+            for name in list(self.__boards.top(True, _all=True)):
+                seen = self.data[name]
+                if name not in self.__foreign and seen.actual_name.lower() not in listed:
+                    self.update(seen, PlayerSeen.leave, count_playtime)
+                    changed.append(name)
+                    if name in bot_list:
+                        bot_list.remove(name)
+                    if name in shadow_list:
+                        shadow_list.remove(name)
+            # A listed name is satisfied by either the player or its bot being online
+            online = {
+                n[:-4].lower() if self.is_bot(n) else n.lower()
+                for n in self.__boards.top(True, _all=True) if n not in self.__foreign
+            }
+            for lower, p in listed.items():
+                if lower not in online:
+                    seen = self[p]
+                    self.update(seen, PlayerSeen.join)
+                    changed.append(seen.name)
+            records = [(n, self.data[n].joined, self.data[n].left) for n in changed]
+            for name in changed:
+                self.__resume_foreign(name)
+        if len(records) == 0:
+            return
+        logger.info(f'Corrected the status of {len(records)} players to match the {len(listed)} players online')
+        logger.debug(f"Corrected players: {', '.join(changed)}")
+        if self.backend.record_many(records):
+            self.save()
 
     def __getitem__(self, name: str) -> PlayerSeen:
-        if name.lower() not in self.lower_data.keys():
-            self[name] = PlayerSeen.deserialize({'name': name})
-        return self.lower_data[name.lower()]
+        with self.__lock:
+            ret = self.get(name)
+            if ret is None:
+                self[name] = PlayerSeen.deserialize({'name': name})
+                ret = self.data[name]
+            return ret
 
     def __setitem__(self, name: str, value: PlayerSeen) -> None:
-        self.data[name] = value
+        with self.__lock:
+            if name not in self.data:
+                self.__lower_index[name.lower()] = name
+                self.__names.add(value.actual_name)
+            self.data[name] = value
+            self.__boards.add(name, value.online, value.is_bot, value.target)
+            self.__refresh_merged(value.actual_name)
 
 
-storage = SeenStorage().load()
+# Loaded in the background from on_load, or handed off from the previous plugin instance on reload
+storage = SeenStorage()
@@ -0,0 +1,147 @@
+import io
+import os
+import csv
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mcd_seen.config import config, psi
+from mcd_seen.utils import logger
+
+EXPORT_FORMATS = ['jsonl', 'csv']
+CSV_HEADER = ['name', 'joined', 'left']
+# Lines joined into one write when exporting
+EXPORT_CHUNK = 1000
+# Player files stat-ed by each task when scanning
+SCAN_CHUNK = 2000
+# Player files in the world folder named after the uuid, any of them is touched when the player leaves
+PLAYER_FILE_FOLDERS = {'playerdata': '.dat', 'stats': '.json'}
+
+
+def export_lines(rows: Iterable[Tuple[str, int, int]], fmt: str) -> Iterator[str]:
+    """
+    Yield the records line by line in an export format
+    :param rows: (name, joined, left) records
+    :param fmt: One of EXPORT_FORMATS
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for row in chain([CSV_HEADER], rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    elif fmt == 'jsonl':
+        for name, joined, left in rows:
+            yield json.dumps({'name': name, 'joined': joined, 'left': left}, ensure_ascii=False) + '\n'
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
+
+
+def export_file(rows: Iterable[Tuple[str, int, int]], fmt: str, path: str) -> int:
+    """
+    Stream the records into path in chunks, the file only appears once it's complete
+    :return: Amount of records written
+    """
+    count = 0
+    lines = export_lines(rows, fmt)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='UTF-8', newline='') as f:
+        while True:
+            chunk = list(islice(lines, EXPORT_CHUNK))
+            if len(chunk) == 0:
+                break
+            f.write(''.join(chunk))
+            count += len(chunk)
+    os.replace(temp_file, path)
+    # The csv header isn't a record
+    return count - 1 if fmt == 'csv' else count
+
+
+def server_folder() -> str:
+    return psi.get_mcdr_config().get('working_directory', 'server')
+
+
+def world_folder() -> str:
+    if config.backfill_world:
+        return config.backfill_world
+    level_name = 'world'
+    properties = os.path.join(server_folder(), 'server.properties')
+    if os.path.isfile(properties):
+        with open(properties, 'r', encoding='UTF-8', errors='replace') as f:
+            for line in f:
+                key, sep, value = line.strip().partition('=')
+                if sep and key.strip() == 'level-name' and value.strip():
+                    level_name = value.strip()
+    return os.path.join(server_folder(), level_name)
+
+
+def read_usercache(path: str) -> Dict[str, str]:
+    """
+    :return: uuid -> player name
+    """
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='UTF-8') as f:
+        entries = json.load(f)
+    return {e['uuid']: e['name'] for e in entries if 'uuid' in e and 'name' in e}
+
+
+def __list_player_files(folder: str, ext: str) -> List[str]:
+    if not os.path.isdir(folder):
+        return []
+    with os.scandir(folder) as it:
+        return [e.path for e in it if e.name.endswith(ext) and e.is_file()]
+
+
+def __stat_player_files(paths: List[str]) -> Dict[str, int]:
+    ret = {}
+    for path in paths:
+        try:
+            mtime = int(os.stat(path).st_mtime)
+        except OSError:
+            continue
+        uuid = os.path.splitext(os.path.basename(path))[0]
+        if mtime > ret.get(uuid, 0):
+            ret[uuid] = mtime
+    return ret
+
+
+def scan_player_files(world: str, workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Latest modification time of the player files of every uuid in the world, scanned with a thread pool
+    :return: uuid -> timestamp
+    """
+    ret = {}        # type: Dict[str, int]
+    with ThreadPoolExecutor(max_workers=workers or None) as pool:
+        listings = pool.map(
+            lambda item: __list_player_files(os.path.join(world, item[0]), item[1]), PLAYER_FILE_FOLDERS.items()
+        )
+        paths = [p for listing in listings for p in listing]
+        chunks = [paths[i:i + SCAN_CHUNK] for i in range(0, len(paths), SCAN_CHUNK)]
+        for result in pool.map(__stat_player_files, chunks):
+            for uuid, mtime in result.items():
+                if mtime > ret.get(uuid, 0):
+                    ret[uuid] = mtime
+    logger.debug(f'Scanned {len(paths)} player files of {len(ret)} players in {world}')
+    return ret
+
+
+def collect_last_seen() -> Tuple[Dict[str, int], int]:
+    """
+    Last seen time of the players in usercache.json, taken from their player files
+    :return: name -> timestamp, and the amount of players with player files
+    """
+    names = read_usercache(os.path.join(server_folder(), 'usercache.json'))
+    mtimes = scan_player_files(world_folder(), config.backfill_workers)
+    ret = {}        # type: Dict[str, int]
+    for uuid, mtime in mtimes.items():
+        name = names.get(uuid)
+        # Players whose name is unknown can't be queried anyway
+        if name is not None and mtime > ret.get(name, 0):
+            ret[name] = mtime
+    return ret, len(mtimes)
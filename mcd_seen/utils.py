@@ -1,13 +1,14 @@
-import os.path
 import re
 import time
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 from mcdreforged.api.rtext import *
 from mcdreforged.api.types import MCDReforgedLogger, ServerInterface
 
 from mcd_seen.config import config
 from mcd_seen.constants import LOG_FILE, NEW_LOG_PATH, OLD_LOG_FILE
+from mcd_seen.logfile import BufferedRotatingFileHandler
 
 TextType = Union[str, RText]
 psi = ServerInterface.get_instance().as_plugin_server_interface()
@@ -21,6 +22,17 @@ class SeenLogger(MCDReforgedLogger):
         if self.__debug:
             super(MCDReforgedLogger, self).debug(*args, **kwargs)
 
+    def set_file(self, file_path: str):
+        # Written from a background thread instead of the MCDR file handler,
+        # the log file of old versions is moved there too instead of blocking the plugin load
+        if self.file_handler is not None:
+            self.unset_file()
+        self.file_handler = BufferedRotatingFileHandler(
+            file_path, archives=[NEW_LOG_PATH], legacy={OLD_LOG_FILE: NEW_LOG_PATH}
+        )
+        self.file_handler.setFormatter(self.FILE_FORMATTER)
+        self.addHandler(self.file_handler)
+
     @classmethod
     def set_verbosity(cls):
         cls.__debug = config.verbose_mode
@@ -30,16 +42,7 @@ class SeenLogger(MCDReforgedLogger):
         if cls.__global_instance is None:
             cls.set_verbosity()
             cls.__global_instance = cls(plugin_id=psi.get_self_metadata().id)
-            old_converted = False
-            try:
-                if os.path.isfile(OLD_LOG_FILE):
-                    os.rename(OLD_LOG_FILE, NEW_LOG_PATH)
-                    old_converted = True
-            except Exception as exc:
-                cls.__global_instance.warning(f'Move old logs to new place failed: {str(exc)}')
             cls.__global_instance.set_file(LOG_FILE)
-            if old_converted:
-                cls.__global_instance.info('Moved old log file to new place')
         return cls.__global_instance
 
 
@@ -98,6 +101,29 @@ def ntr(translation_key: str, *args, _mcdr_tr_language: Optional[str] = None, la
                 raise KeyError(f'Translation key "{translation_key}" not found with language {languages}')
 
 
+# (translation key, language) -> text, keyed by the resolved language and dropped with the module on plugin reload
+_tr_cache = {}      # type: Dict[Tuple[str, str], str]
+_units_cache = {}   # type: Dict[Tuple[str, str], List[str]]
+
+
+def ctr(translation_key: str, _mcdr_tr_language: Optional[str] = None, allow_failure: bool = True) -> TextType:
+    """
+    Memoized ntr for texts without format args
+    :param translation_key: Your translation key
+    :param _mcdr_tr_language: Required language specified, MCDR language by default
+    :param allow_failure: Allow failure to be thrown
+    :return: Your message text
+    """
+    language = _mcdr_tr_language or psi.get_mcdr_language()
+    key = (translation_key, language)
+    ret = _tr_cache.get(key)
+    if ret is None:
+        ret = ntr(translation_key, _mcdr_tr_language=language, allow_failure=allow_failure)
+        if isinstance(ret, str):
+            _tr_cache[key] = ret
+    return ret
+
+
 def tr(translation_key: str, *args, with_prefix=True, **kwargs) -> RTextMCDRTranslation:
     """
     Return a translation object
@@ -154,7 +180,11 @@ def fmt_time_tr(translation_key: str, t: Union[int, str], _mcdr_tr_language: Opt
         _mcdr_tr_language = language
     t = int(t)
     values = []
-    units = ntr(translation_key, language=_mcdr_tr_language, allow_failure=allow_failure).split(' ')
+    language = _mcdr_tr_language or psi.get_mcdr_language()
+    units = _units_cache.get((translation_key, language))
+    if units is None:
+        units = ctr(translation_key, _mcdr_tr_language=language, allow_failure=allow_failure).split(' ')
+        _units_cache[(translation_key, language)] = units
     scales = [60, 60, 24]
 
     for scale in scales:
@@ -177,6 +207,23 @@ def fmt_time_tr(translation_key: str, t: Union[int, str], _mcdr_tr_language: Opt
     return '§6' + ' '.join(s) + '§r'
 
 
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(text: str) -> Optional[int]:
+    """
+    Seconds of a duration like 90m, 1d12h or 3600
+    :return: None if it's not a duration
+    """
+    text = text.strip().lower()
+    if text.isdigit():
+        return int(text)
+    parts = re.findall(r'(\d+)([smhdw])', text)
+    if len(parts) == 0 or ''.join(v + u for v, u in parts) != text:
+        return None
+    return sum(int(v) * DURATION_UNITS[u] for v, u in parts)
+
+
 def now_time() -> int:
     return int(time.time())
 
@@ -189,13 +236,31 @@ def bot_name(player: str):
     return player + '@bot'
 
 
-def is_bot(name: str) -> bool:
-    name = name.upper()
-    blacklist = 'A_Pi#nw#sw#SE#ne#nf#SandWall#storage#Steve#Alex#DuperMaster#Nya_Vanilla#Witch#Klio_5#######'.upper()
-    black_keys = [r'farm', r'bot_', r'cam', r'_b_', r'bot-', r'bot\d', r'^bot']
-    if blacklist.find(name) >= 0 or len(name) < 4 or len(name) > 16:
-        return True
-    for black_key in black_keys:
-        if re.search(black_key.upper(), name):
+class BotClassifier:
+    """
+    Guess if a name belongs to a bot, built once from config and memoized
+    """
+    def __init__(self, blacklist: Iterable[str], keywords: Iterable[str], cache_size: int = 8192):
+        self.__blacklist = frozenset(n.upper() for n in blacklist)
+        keywords = [k for k in keywords if k != '']
+        self.__keywords = re.compile('|'.join(f'(?:{k})' for k in keywords), re.IGNORECASE) if len(keywords) > 0 else None
+        self.classify = lru_cache(maxsize=cache_size)(self.__classify)
+
+    @classmethod
+    def from_config(cls) -> 'BotClassifier':
+        return cls(config.bot_blacklist, config.bot_keywords)
+
+    def __classify(self, name: str) -> bool:
+        if len(name) < 4 or len(name) > 16 or name.upper() in self.__blacklist:
             return True
-    return False
+        return self.__keywords is not None and self.__keywords.search(name) is not None
+
+    def __call__(self, name: str) -> bool:
+        return self.classify(name)
+
+
+bot_classifier = BotClassifier.from_config()
+
+
+def is_bot(name: str) -> bool:
+    return bot_classifier.classify(name)
@@ -0,0 +1,70 @@
+import threading
+
+from typing import Any, Callable
+
+from mcdreforged.api.decorator import new_thread
+
+from mcd_seen.config import config
+from mcd_seen.utils import logger, psi
+
+
+class SaveWorker:
+    """
+    Runs a save function on a single background thread, saves requested within config.save_interval are coalesced
+    """
+    def __init__(self, save: Callable[[], Any]):
+        self.__save = save
+        self.__cond = threading.Condition()
+        self.__save_lock = threading.Lock()
+        self.__dirty = False
+        self.__running = False
+        self.__stopped = False
+
+    @property
+    def dirty(self) -> bool:
+        return self.__dirty
+
+    def mark_dirty(self):
+        with self.__cond:
+            self.__dirty = True
+            if not self.__running and not self.__stopped:
+                self.__running = True
+                self.__run()
+            self.__cond.notify_all()
+
+    def flush(self):
+        """
+        Save right now in the calling thread if there are pending changes
+        """
+        with self.__save_lock:
+            with self.__cond:
+                if not self.__dirty:
+                    return
+                self.__dirty = False
+            try:
+                self.__save()
+            except Exception:
+                logger.exception('Failed to save seen data')
+                with self.__cond:
+                    self.__dirty = True
+
+    def stop(self):
+        """
+        Stop the worker thread and flush pending changes
+        """
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify_all()
+        self.flush()
+
+    @new_thread(psi.get_self_metadata().name + '_Writer')
+    def __run(self):
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: self.__dirty or self.__stopped)
+                if self.__stopped:
+                    self.__running = False
+                    return
+                # Let following changes pile up before writing
+                self.__cond.wait_for(lambda: self.__stopped, timeout=config.save_interval)
+            self.flush()